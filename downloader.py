@@ -3,12 +3,28 @@
 yt-dlp 下載核心模組
 """
 import os
+import re
 import shutil
 import glob
-from typing import Callable, Optional
-import yt_dlp
+import time
+from typing import Callable, List, Optional, Tuple
+from yt_dlp.utils import download_range_func
 
-from utils.config import QUALITY_OPTIONS, ARIA2C_OPTIONS, ensure_download_path
+from engine.fragment_downloader import ParallelYoutubeDL
+from engine.network import dns_cache, extract_info
+from engine.postprocess import FFmpegFinalizePP, FinalizeYoutubeDL
+from engine.profiling import profiler
+from engine.replay import harness
+from engine.session import session_manager
+from engine.subtitles import SubtitleCache
+from utils.config import (
+    QUALITY_OPTIONS, ARIA2C_OPTIONS, PARALLEL_DOWNLOAD_CONNECTIONS,
+    LONG_CONTENT_FFMPEG_ARGS, EMBED_SUBTITLES, EMBED_METADATA,
+    TRANSCODE_PROFILES, DEFAULT_TRANSCODE_PROFILE, ensure_download_path
+)
+
+# 解析時的格式選擇結果 (下載時依畫質設定重新選擇，不可沿用)
+STALE_SELECTION_KEYS = ('requested_formats', 'requested_downloads', 'url')
 
 
 def get_aria2c_path() -> str:
@@ -74,6 +90,22 @@ def get_ffmpeg_path() -> str:
     return None
 
 
+def get_ffprobe_path() -> str:
+    """獲取 ffprobe 可執行檔路徑 (通常與 FFmpeg 放在同一資料夾)"""
+    system_ffprobe = shutil.which('ffprobe')
+    if system_ffprobe:
+        return system_ffprobe
+    
+    ffmpeg_path = get_ffmpeg_path()
+    if ffmpeg_path:
+        ext = '.exe' if ffmpeg_path.lower().endswith('.exe') else ''
+        candidate = os.path.join(os.path.dirname(ffmpeg_path), 'ffprobe' + ext)
+        if os.path.isfile(candidate):
+            return candidate
+    
+    return None
+
+
 def setup_ffmpeg_env():
     """設置 FFmpeg 環境變數，並確保 ffmpeg.exe 存在"""
     ffmpeg_path = get_ffmpeg_path()
@@ -102,6 +134,57 @@ def setup_ffmpeg_env():
     return ffmpeg_dir
 
 
+def parse_time(text: str) -> float:
+    """解析時間字串 (例如 90、1:30、1:02:03.5、inf) 為秒數"""
+    text = text.strip()
+    if text.lower() in ('inf', 'end'):
+        return float('inf')
+    seconds = 0.0
+    for part in text.split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def parse_sections(spec: str) -> Tuple[List[str], List[Tuple[float, float]]]:
+    """解析片段設定
+    
+    以逗號分隔多個片段，時間範圍寫成「開始-結束」(開始可省略代表 0，
+    結束可寫 inf 代表到結尾)，其餘視為章節標題的正規表示式。
+    相容 yt-dlp --download-sections 的「*」前綴寫法。
+    
+    Returns:
+        (章節正規表示式列表, 時間範圍列表)
+    """
+    chapters = []
+    ranges = []
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if item.startswith('*'):
+            item = item[1:].strip()
+        match = re.fullmatch(r'([\d:.]*)\s*-\s*([\d:.]+|inf|end)', item, re.IGNORECASE)
+        if match:
+            start = parse_time(match.group(1)) if match.group(1) else 0.0
+            end = parse_time(match.group(2))
+            if start >= end:
+                raise ValueError(f"片段範圍無效: {item}")
+            ranges.append((start, end))
+        else:
+            re.compile(item)
+            chapters.append(item)
+    return chapters, ranges
+
+
+def file_identity(path: Optional[str]) -> Optional[Tuple[int, int]]:
+    """檔案的 (inode, 修改時間)，用於判斷後處理是否寫出了新檔案"""
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
 class VideoDownloader:
     """影片下載器類別"""
     
@@ -112,7 +195,14 @@ class VideoDownloader:
         quality: str = "最高畫質",
         progress_callback: Optional[Callable] = None,
         status_callback: Optional[Callable] = None,
-        use_aria2c: bool = True
+        use_aria2c: bool = True,
+        chapters: Optional[List[str]] = None,
+        ranges: Optional[List[Tuple[float, float]]] = None,
+        precise_cuts: bool = False,
+        long_mode: bool = False,
+        embed_subtitles: bool = EMBED_SUBTITLES,
+        embed_metadata: bool = EMBED_METADATA,
+        transcode: str = DEFAULT_TRANSCODE_PROFILE
     ):
         self.url = url
         self.output_path = ensure_download_path(output_path)
@@ -120,14 +210,54 @@ class VideoDownloader:
         self.progress_callback = progress_callback
         self.status_callback = status_callback
         self.use_aria2c = use_aria2c
+        # 片段下載：只抓取需要的區段，每個區段輸出一個檔案
+        self.chapters = chapters or []
+        self.ranges = ranges or []
+        # 精確切割會在切點重新編碼關鍵幀；預設對齊關鍵幀直接複製
+        self.precise_cuts = precise_cuts
+        # 直播從頭錄製 (live_from_start)；直播一律邊下載邊寫入磁碟，記憶體用量不隨長度增加
+        self.long_mode = long_mode
+        # 字幕 / 章節 / 標籤於最終封裝時一次嵌入
+        self.embed_subtitles = embed_subtitles
+        self.embed_metadata = embed_metadata
+        # 轉檔設定名稱 (見 TRANSCODE_PROFILES)
+        self.transcode = transcode
+        # 回傳 {語言: 字幕檔路徑} 的函數 (引擎會提供預取結果，否則於封裝時下載)
+        self.subtitle_source: Optional[Callable[[], dict]] = None
+        # 最近一次下載使用的影片資訊 (含 requested_downloads 輸出路徑)
+        self.info: Optional[dict] = None
         self.video_title = ""
         self._cancelled = False
+        # 效能記錄：格式選擇開始時間與各檔案 / 後處理的開始時間
+        self._selecting_since: Optional[float] = None
+        self._span_starts: dict = {}
+        # 寫入磁碟的位元組數 (下載的串流與後處理寫出的檔案，跨重新下載累計)
+        self.bytes_written = 0
+        self._pp_files: dict = {}
+        
+    def _end_format_selection(self):
+        """第一個下載或後處理開始時結束格式選擇區段"""
+        if self._selecting_since is not None:
+            profiler.record('format selection', self.url, self._selecting_since, time.perf_counter())
+            self._selecting_since = None
         
     def _progress_hook(self, d: dict):
         """進度回調處理"""
         if self._cancelled:
             raise Exception("下載已取消")
             
+        self._end_format_selection()
+        filename = d.get('filename', '')
+        self._span_starts.setdefault(filename, time.perf_counter())
+        if d['status'] == 'finished':
+            profiler.record('download', self.url, self._span_starts.pop(filename), time.perf_counter(),
+                            file=os.path.basename(filename))
+            if harness.recording:
+                harness.save_stream(d.get('info_dict'), filename)
+            # 從串流存放區以 reflink / 硬連結取得的檔案不佔寫入量
+            if d.get('stored') in (None, 'copy') and os.path.isfile(filename):
+                self.bytes_written += os.path.getsize(filename)
+            
         if d['status'] == 'downloading':
             # 計算進度百分比
             total = d.get('total_bytes') or d.get('total_bytes_estimate', 0)
@@ -160,6 +290,31 @@ class VideoDownloader:
                     'filename': d.get('filename', '')
                 })
                 
+    def _postprocessor_hook(self, d: dict):
+        """後處理回調處理"""
+        self._end_format_selection()
+        name = d.get('postprocessor', '')
+        if d['status'] == 'started':
+            self._span_starts[name] = time.perf_counter()
+        elif d['status'] == 'finished' and name in self._span_starts:
+            profiler.record(f"postprocessor:{name}", self.url, self._span_starts.pop(name), time.perf_counter())
+            
+        # 後處理寫出新檔案 (暫存檔改名或換了副檔名) 時計入寫入量
+        path = (d.get('info_dict') or {}).get('filepath')
+        if d['status'] == 'started':
+            self._pp_files[name] = file_identity(path)
+        elif d['status'] == 'finished':
+            identity = file_identity(path)
+            if identity is not None and identity != self._pp_files.pop(name, None):
+                self.bytes_written += os.path.getsize(path)
+            
+        if d['status'] == 'started' and self.progress_callback:
+            self.progress_callback({
+                'percent': 100,
+                'status': 'processing',
+                'postprocessor': d.get('postprocessor', '')
+            })
+            
     def _check_aria2c(self) -> bool:
         """檢查 aria2c 是否可用"""
         return get_aria2c_path() is not None
@@ -168,34 +323,66 @@ class VideoDownloader:
         """檢查 ffmpeg 是否可用"""
         return get_ffmpeg_path() is not None
         
-    def get_video_info(self) -> dict:
-        """獲取影片資訊"""
+    def extract_info(self) -> dict:
+        """獲取完整的 yt-dlp 影片資訊 (可傳給 download() 以避免重複解析)"""
         ydl_opts = {
             'quiet': True,
             'no_warnings': True,
         }
+        if self.long_mode:
+            # 直播需在解析時即要求從頭開始的格式
+            ydl_opts['live_from_start'] = True
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(self.url, download=False)
-            self.video_title = info.get('title', 'Unknown')
-            return {
-                'title': info.get('title', 'Unknown'),
-                'duration': info.get('duration', 0),
-                'thumbnail': info.get('thumbnail', ''),
-                'uploader': info.get('uploader', 'Unknown'),
-            }
+        if session_manager.paused(self.url) and self.status_callback:
+            self.status_callback("網站限流中，暫停解析，稍後自動繼續...")
+
+        # 經由共用網路層解析，重複使用解析執行緒的連線池
+        info = extract_info(self.url, ydl_opts)
+        self.video_title = info.get('title', 'Unknown')
+        return info
+        
+    def get_video_info(self) -> dict:
+        """獲取影片資訊"""
+        info = self.extract_info()
+        return {
+            'title': info.get('title', 'Unknown'),
+            'duration': info.get('duration', 0),
+            'thumbnail': info.get('thumbnail', ''),
+            'uploader': info.get('uploader', 'Unknown'),
+        }
     
-    def download(self) -> bool:
-        """執行下載"""
+    def _subtitle_source(self, info: dict) -> Optional[Callable[[], dict]]:
+        """字幕來源：優先使用預取結果"""
+        if not self.embed_subtitles:
+            return None
+        if self.subtitle_source:
+            return self.subtitle_source
+        return lambda: SubtitleCache().fetch_for(info)
+        
+    def _is_live_content(self, info: dict) -> bool:
+        """是否為進行中的直播 (一般影片不論長度都走 aria2c / 內建多連線下載器)"""
+        return bool(info.get('is_live'))
+        
+    def download(self, info: Optional[dict] = None) -> bool:
+        """執行下載
+        
+        Args:
+            info: 已由 extract_info() 取得的影片資訊，提供時略過重新解析
+        """
         try:
-            if self.status_callback:
-                self.status_callback("正在獲取影片資訊...")
-                
-            # 獲取影片資訊
-            info = self.get_video_info()
+            if info is None:
+                if self.status_callback:
+                    self.status_callback("正在獲取影片資訊...")
+                    
+                # 獲取影片資訊
+                info = self.extract_info()
+            # extract_info 已依預設格式選過一次：移除舊的選擇結果，
+            # 否則改選單一格式時舊的 requested_formats 會被沿用
+            info = {key: value for key, value in info.items() if key not in STALE_SELECTION_KEYS}
+            self.info = info
             
             if self.status_callback:
-                self.status_callback(f"開始下載: {info['title']}")
+                self.status_callback(f"開始下載: {info.get('title', 'Unknown')}")
             
             # 構建 yt-dlp 選項
             format_string = QUALITY_OPTIONS.get(self.quality, QUALITY_OPTIONS["最高畫質"])
@@ -207,34 +394,67 @@ class VideoDownloader:
                 'format': format_string,
                 'outtmpl': os.path.join(self.output_path, '%(title)s.%(ext)s'),
                 'progress_hooks': [self._progress_hook],
+                'postprocessor_hooks': [self._postprocessor_hook],
                 'merge_output_format': 'mp4',
                 'quiet': False,
                 'no_warnings': False,
                 'ignoreerrors': False,
-                # 後處理：確保轉換為 H.264 + AAC 格式
-                'postprocessors': [{
-                    'key': 'FFmpegVideoRemuxer',
-                    'preferedformat': 'mp4',
-                }],
-                # 全局 FFmpeg 輸出參數：強制轉換音頻為 AAC
-                'postprocessor_args': [
-                    '-c:v', 'copy',         # 視訊直接複製（不重新編碼）
-                    '-c:a', 'aac',          # 音訊轉換為 AAC
-                    '-b:a', '192k',         # 音訊比特率
-                    '-strict', 'experimental',
-                    '-movflags', '+faststart'
-                ],
+                # 合併時的 FFmpeg 輸出參數：強制轉換音頻為 AAC
+                # (一般情況由 FFmpegFinalizePP 在最終封裝時一併合併，不會使用)
+                'postprocessor_args': {
+                    'merger': [
+                        '-c:v', 'copy',         # 視訊直接複製（不重新編碼）
+                        '-c:a', 'aac',          # 音訊轉換為 AAC
+                        '-b:a', '192k',         # 音訊比特率
+                        '-strict', 'experimental',
+                        '-movflags', '+faststart'
+                    ],
+                },
             }
+            finalize = True
+            
+            # 重播時不使用串流存放區，讓每次都經過完整的下載流程
+            if harness.replaying:
+                ydl_opts['stream_store'] = False
             
             # 設置 FFmpeg 路徑
             if ffmpeg_dir:
                 ydl_opts['ffmpeg_location'] = ffmpeg_dir
             
+            # 片段下載 (同一次解析結果輸出多個檔案)
+            if self.chapters or self.ranges:
+                # 「到結尾」的範圍以影片長度取代，讓檔名中的秒數可被格式化
+                duration = info.get('duration')
+                ranges = [
+                    (start, min(end, duration) if duration else end)
+                    for start, end in self.ranges
+                ]
+                ydl_opts['download_ranges'] = download_range_func(self.chapters, ranges)
+                ydl_opts['force_keyframes_at_cuts'] = self.precise_cuts
+                ydl_opts['outtmpl'] = os.path.join(
+                    self.output_path,
+                    '%(title)s [%(section_start)d-%(section_end)d].%(ext)s'
+                )
+            
             # 檢查 aria2c 是否可用
             aria2c_available = self._check_aria2c()
             
             # 如果 aria2c 可用且啟用，使用 aria2c 進行下載加速
-            if self.use_aria2c and aria2c_available:
+            ydl_class = FinalizeYoutubeDL
+            if self._is_live_content(info):
+                # 直播 (HLS / DASH)：由 ffmpeg 直接讀取音視訊串流，邊下載邊封裝成
+                # fragmented MP4，不留下各自的 .part 檔，也不需事後合併與 remux。
+                # 從頭錄製的 YouTube 格式 (http_dash_segments_generator) ffmpeg 不支援，
+                # 由 yt-dlp 內建的 DASH 下載器將片段依序附加到磁碟上的檔案，結束後再合併
+                ydl_opts['live_from_start'] = self.long_mode
+                ydl_opts['external_downloader'] = {'m3u8': 'ffmpeg', 'dash': 'ffmpeg'}
+                ydl_opts['external_downloader_args'] = {'ffmpeg_o': LONG_CONTENT_FFMPEG_ARGS}
+                ydl_opts['hls_use_mpegts'] = False
+                ydl_opts['concurrent_fragment_downloads'] = PARALLEL_DOWNLOAD_CONNECTIONS
+                finalize = False
+                if self.status_callback:
+                    self.status_callback("直播模式：邊下載邊寫入...")
+            elif self.use_aria2c and aria2c_available:
                 ydl_opts['external_downloader'] = 'aria2c'
                 ydl_opts['external_downloader_args'] = {
                     'aria2c': ARIA2C_OPTIONS
@@ -242,15 +462,34 @@ class VideoDownloader:
                 if self.status_callback:
                     self.status_callback("使用 aria2c 加速下載中...")
             else:
+                # 否則使用內建多連線下載器：單一串流以範圍請求並行下載，
+                # HLS/DASH 片段則交給 yt-dlp 的並行片段下載
+                ydl_class = ParallelYoutubeDL
+                ydl_opts['parallel_connections'] = PARALLEL_DOWNLOAD_CONNECTIONS
+                ydl_opts['concurrent_fragment_downloads'] = PARALLEL_DOWNLOAD_CONNECTIONS
                 if self.status_callback:
                     if not aria2c_available:
-                        self.status_callback("aria2c 未找到，使用預設下載器...")
+                        self.status_callback("aria2c 未找到，使用內建多連線下載器...")
                     else:
-                        self.status_callback("下載中...")
+                        self.status_callback("使用內建多連線下載器...")
             
-            # 執行下載
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([self.url])
+            # 執行下載 (沿用已解析的資訊，不再重新請求頁面)
+            with ydl_class(ydl_opts) as ydl:
+                # 共用 Cookie
+                session_manager.attach(ydl)
+                if finalize:
+                    # 後處理：確保為 MP4 (H.264 + AAC)，並在同一次 ffmpeg 中嵌入字幕 / 章節 / 標籤
+                    ydl.add_post_processor(FFmpegFinalizePP(
+                        ydl,
+                        embed_metadata=self.embed_metadata,
+                        subtitle_source=self._subtitle_source(info),
+                        transcode=TRANSCODE_PROFILES.get(self.transcode)
+                    ), when='post_process')
+                self._selecting_since = time.perf_counter()
+                self._span_starts = {}
+                # yt-dlp 在副本上處理，輸出路徑 (requested_downloads) 只在回傳值中
+                self.info = ydl.process_ie_result(info, download=True)
+            session_manager.save_cookies()
                 
             if self.status_callback:
                 self.status_callback("下載完成!")
@@ -284,6 +523,7 @@ def check_dependencies() -> dict:
     # 設置環境
     setup_ffmpeg_env()
     setup_aria2c_env()
+    dns_cache.install()
     
     return {
         'ffmpeg': get_ffmpeg_path() is not None,
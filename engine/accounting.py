@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+用量統計與配額 - 依任務擁有者 (使用者 / 團隊) 累計資源用量
+
+每個任務結束時累計傳輸位元組數、工作執行緒 CPU 秒數、輸出檔案大小與
+寫入磁碟的位元組數 (含合併 / 封裝的中間檔案)，
+保存於 JSON 檔案。下載引擎在任務開始前檢查擁有者的配額，並以每個擁有者
+的同時任務上限排程，避免單一團隊的大批次佔滿所有名額。
+進行中的任務在傳輸前預留估計用量，結束時以實際用量取代，
+大批次同時提交時各任務不會都因尚無用量而通過檢查。
+"""
+import csv
+import json
+import os
+import threading
+from typing import Dict, Optional
+
+from utils.config import USAGE_LEDGER_PATH, OWNER_QUOTAS, DEFAULT_OWNER_QUOTA
+
+
+# 累計欄位
+USAGE_FIELDS = ('jobs', 'completed', 'failed', 'bytes', 'cpu_seconds', 'disk_bytes', 'bytes_written')
+
+# 配額欄位對應的用量欄位
+QUOTA_FIELDS = {
+    'max_bytes': 'bytes',
+    'max_cpu_seconds': 'cpu_seconds',
+    'max_disk_bytes': 'disk_bytes',
+}
+
+# 可設定的配額欄位
+QUOTA_KEYS = tuple(QUOTA_FIELDS) + ('max_concurrent',)
+
+
+def validate_quota(quota) -> dict:
+    """檢查配額設定：只接受已知欄位與非負數值，否則拋出 ValueError"""
+    if not isinstance(quota, dict):
+        raise ValueError(f"配額必須為物件: {quota!r}")
+    for key, value in quota.items():
+        if key not in QUOTA_KEYS:
+            raise ValueError(f"未知的配額欄位: {key}")
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+            raise ValueError(f"{key} 必須為非負數值: {value!r}")
+    return dict(quota)
+
+
+def estimate_size(info: Optional[dict]) -> int:
+    """依解析結果估計下載大小 (未知時為 0)"""
+    if not info:
+        return 0
+    total = 0
+    for fmt in info.get('requested_formats') or [info]:
+        size = fmt.get('filesize') or fmt.get('filesize_approx')
+        if not size and fmt.get('tbr') and info.get('duration'):
+            size = fmt['tbr'] * 1000 / 8 * info['duration']
+        total += int(size or 0)
+    return total
+
+
+def output_size(info: Optional[dict]) -> int:
+    """任務輸出檔案的總大小"""
+    if not info:
+        return 0
+    total = 0
+    for download in info.get('requested_downloads') or [info]:
+        path = download.get('filepath') or download.get('_filename')
+        if path and os.path.isfile(path):
+            total += os.path.getsize(path)
+    return total
+
+
+class UsageLedger:
+    """各擁有者的累計用量與配額 (JSON 檔案保存)"""
+
+    def __init__(
+        self,
+        path: str = USAGE_LEDGER_PATH,
+        quotas: Optional[Dict[str, dict]] = None,
+        default_quota: Optional[dict] = None
+    ):
+        self.path = path
+        self.quotas = dict(OWNER_QUOTAS if quotas is None else quotas)
+        self.default_quota = dict(DEFAULT_OWNER_QUOTA if default_quota is None else default_quota)
+        self.usage: Dict[str, dict] = {}
+        # 進行中任務預留的用量 {擁有者: {任務 ID: {用量欄位: 數量}}}
+        self.reserved: Dict[str, Dict[str, dict]] = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """讀取用量紀錄"""
+        if not self.path or not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                usage = json.load(f)
+        except (ValueError, OSError):
+            # 損毀或寫入到一半的紀錄：從空白開始，不影響下載
+            return
+        if isinstance(usage, dict):
+            self.usage = usage
+
+    def save(self):
+        """寫入用量紀錄 (先寫入暫存檔再取代，中斷時保留舊紀錄)"""
+        if not self.path:
+            return
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self.usage, f, ensure_ascii=False, indent=2)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+    def quota(self, owner: str) -> dict:
+        """擁有者的配額 (未設定的欄位沿用預設配額)"""
+        return dict(self.default_quota, **self.quotas.get(owner, {}))
+
+    def max_concurrent(self, owner: str) -> int:
+        """擁有者的同時任務上限，0 表示不限制"""
+        return int(self.quota(owner).get('max_concurrent') or 0)
+
+    def set_quota(self, owner: str, **limits):
+        """調整擁有者的配額 (例如 max_concurrent=2)"""
+        self.quotas.setdefault(owner, {}).update(validate_quota(limits))
+
+    def _pending(self, owner: str) -> dict:
+        """進行中任務預留的用量合計 (須持有鎖)"""
+        totals = {}
+        for reservation in self.reserved.get(owner, {}).values():
+            for key, amount in reservation.items():
+                totals[key] = totals.get(key, 0) + amount
+        return totals
+
+    def _check_quota(self, owner: str, need: dict) -> Optional[str]:
+        """計入預留用量與本次需求的配額檢查 (須持有鎖)"""
+        usage = self.usage.get(owner, {})
+        pending = self._pending(owner)
+        quota = self.quota(owner)
+        for quota_key, usage_key in QUOTA_FIELDS.items():
+            limit = quota.get(quota_key)
+            if not limit:
+                continue
+            used = usage.get(usage_key, 0) + pending.get(usage_key, 0)
+            amount = need.get(usage_key, 0)
+            if used >= limit or used + amount > limit:
+                if amount:
+                    return f"{owner} 的配額不足 ({usage_key}: {used:.0f} + {amount:.0f} / {limit})"
+                return f"{owner} 的配額已用盡 ({usage_key}: {used:.0f} / {limit})"
+        return None
+
+    def check_quota(self, owner: str) -> Optional[str]:
+        """配額已用盡時回傳原因 (含進行中任務預留的用量)"""
+        with self._lock:
+            return self._check_quota(owner, {})
+
+    def reserve(self, owner: str, job_id: str, amounts: dict) -> Optional[str]:
+        """檢查配額並為進行中的任務預留估計用量，不足時回傳原因 (不預留)
+
+        同一任務再次預留時取代先前的預留。
+        """
+        with self._lock:
+            reservations = self.reserved.setdefault(owner, {})
+            previous = reservations.pop(job_id, None)
+            reason = self._check_quota(owner, amounts)
+            if reason is None:
+                reservations[job_id] = dict(amounts)
+            elif previous is not None:
+                reservations[job_id] = previous
+            if not reservations:
+                del self.reserved[owner]
+            return reason
+
+    def release(self, owner: str, job_id: str):
+        """任務結束：移除預留 (實際用量由 record() 累計)"""
+        with self._lock:
+            reservations = self.reserved.get(owner)
+            if reservations is not None:
+                reservations.pop(job_id, None)
+                if not reservations:
+                    del self.reserved[owner]
+
+    def record(
+        self,
+        owner: str,
+        success: bool,
+        bytes_transferred: int,
+        cpu_seconds: float,
+        disk_bytes: int,
+        bytes_written: int = 0
+    ):
+        """累計一個已結束任務的用量"""
+        with self._lock:
+            usage = self.usage.setdefault(owner, {})
+            # 舊紀錄可能缺少後來新增的欄位
+            for field in USAGE_FIELDS:
+                usage.setdefault(field, 0)
+            usage['jobs'] += 1
+            usage['completed' if success else 'failed'] += 1
+            usage['bytes'] += bytes_transferred
+            usage['cpu_seconds'] += cpu_seconds
+            usage['disk_bytes'] += disk_bytes
+            usage['bytes_written'] += bytes_written
+        self.save()
+
+    def reset(self, owner: Optional[str] = None):
+        """清除用量 (未指定擁有者時清除全部)"""
+        with self._lock:
+            if owner is None:
+                self.usage.clear()
+            else:
+                self.usage.pop(owner, None)
+        self.save()
+
+    def report(self) -> Dict[str, dict]:
+        """各擁有者的用量與配額"""
+        with self._lock:
+            owners = set(self.usage) | set(self.quotas) | set(self.reserved)
+            return {
+                owner: dict(
+                    {field: 0 for field in USAGE_FIELDS},
+                    **self.usage.get(owner, {}),
+                    quota=self.quota(owner),
+                    reserved=self._pending(owner)
+                )
+                for owner in sorted(owners)
+            }
+
+    def export(self, path: str):
+        """匯出用量報表 (副檔名為 .csv 時輸出 CSV，否則為 JSON)"""
+        report = self.report()
+        if path.lower().endswith('.csv'):
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(('owner',) + USAGE_FIELDS + tuple(QUOTA_FIELDS) + ('max_concurrent',))
+                for owner, row in report.items():
+                    quota = row['quota']
+                    writer.writerow(
+                        [owner] + [row[field] for field in USAGE_FIELDS]
+                        + [quota.get(key, '') for key in QUOTA_FIELDS] + [quota.get('max_concurrent', '')]
+                    )
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,599 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio 下載引擎 - 以協程排程解析、傳輸與後處理三個階段
+"""
+import asyncio
+import itertools
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from downloader import VideoDownloader
+from engine.accounting import UsageLedger, estimate_size, output_size
+from engine.events import (
+    EventBus, JobEvent, JOB_QUEUED, JOB_STARTED, JOB_PROGRESS, JOB_MERGING, JOB_DONE, JOB_FAILED
+)
+from engine.network import dns_cache, extractor_pool
+from engine.profiling import profiler
+from engine.subtitles import SubtitleCache
+from engine.thumbnail_cache import ThumbnailCache, select_thumbnail
+from engine.verify import DownloadVerifier
+from utils.config import (
+    MAX_CONCURRENT_DOWNLOADS, MAX_CONCURRENT_EXTRACTIONS, MAX_CONCURRENT_POSTPROCESS,
+    MAX_CONCURRENT_PREFETCH, MAX_POOL_SIZE, MAX_REDOWNLOADS, VERIFY_DOWNLOADS, EMBED_SUBTITLES, EMBED_METADATA,
+    DEFAULT_TRANSCODE_PROFILE, DEFAULT_OWNER, INFO_TTL
+)
+
+
+# 引擎階段名稱
+STAGE_EXTRACT = 'extract'
+STAGE_TRANSFER = 'transfer'
+STAGE_POSTPROCESS = 'postprocess'
+STAGE_PREFETCH = 'prefetch'
+
+# 下載完成後保留的影片資訊欄位 (其餘如 formats / fragments 清單可能非常龐大)
+SLIM_INFO_KEYS = (
+    'id', 'title', 'uploader', 'duration', 'ext', 'filesize', 'filesize_approx',
+    'vcodec', 'acodec', 'format_id', 'filepath', '_filename', 'is_live', 'was_live',
+    'section_start', 'section_end', 'extractor_key', 'reencoded',
+)
+
+
+def slim_info(info: Optional[dict]) -> Optional[dict]:
+    """只保留後處理需要的欄位，讓大型資訊字典可以被釋放"""
+    if info is None:
+        return None
+    slim = {key: info[key] for key in SLIM_INFO_KEYS if key in info}
+    slim['requested_downloads'] = [
+        {key: download[key] for key in SLIM_INFO_KEYS if key in download}
+        for download in info.get('requested_downloads') or []
+    ]
+    return slim
+
+
+class StageLimiter:
+    """可在執行中調整上限的階段名額 (調低時不中斷進行中的工作，只暫停放行)"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.waiting = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condition:
+            self.waiting += 1
+            try:
+                await self._condition.wait_for(lambda: self.active < self.limit)
+            finally:
+                self.waiting -= 1
+            self.active += 1
+
+    async def __aexit__(self, *exc_info):
+        async with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+    async def set_limit(self, limit: int):
+        async with self._condition:
+            self.limit = limit
+            self._condition.notify_all()
+
+
+# 任務 ID 產生器 (同一網址可同時有多個任務，例如不同畫質或資料夾)
+_job_ids = itertools.count(1)
+
+
+class DownloadJob:
+    """單個下載任務"""
+
+    def __init__(
+        self,
+        url: str,
+        output_path: str,
+        quality: str = "最高畫質",
+        use_aria2c: bool = True,
+        chapters: Optional[List[str]] = None,
+        ranges: Optional[List[Tuple[float, float]]] = None,
+        precise_cuts: bool = False,
+        long_mode: bool = False,
+        verify: bool = VERIFY_DOWNLOADS,
+        embed_subtitles: bool = EMBED_SUBTITLES,
+        embed_metadata: bool = EMBED_METADATA,
+        transcode: str = DEFAULT_TRANSCODE_PROFILE,
+        owner: str = DEFAULT_OWNER
+    ):
+        self.id = f"job-{next(_job_ids)}"
+        self.url = url
+        self.output_path = output_path
+        self.quality = quality
+        self.use_aria2c = use_aria2c
+        self.chapters = chapters or []
+        self.ranges = ranges or []
+        self.precise_cuts = precise_cuts
+        self.long_mode = long_mode
+        self.verify = verify
+        self.embed_subtitles = embed_subtitles
+        self.embed_metadata = embed_metadata
+        self.transcode = transcode
+        # 擁有者 (使用者 / 團隊)，用於用量統計、配額與同時任務上限
+        self.owner = owner or DEFAULT_OWNER
+        # 後處理要求重新下載時設定：空列表代表整個檔案，否則為需重抓的片段
+        self.redownload_ranges: Optional[List[Tuple[float, float]]] = None
+        self.retries = 0
+        self.info: Optional[dict] = None
+        # 完整解析結果的取得時間 (只有精簡資訊或尚未解析時為 None)
+        self.extracted_at: Optional[float] = None
+        # 依解析結果估計的下載大小 (配額預留用)
+        self.size_estimate: Optional[int] = None
+        self.title: Optional[str] = None
+        self.error: Optional[str] = None
+        self.downloader: Optional[VideoDownloader] = None
+        self.cancelled = False
+        # 已傳輸的位元組數 (跨檔案與重新下載累計)
+        self.bytes_transferred = 0
+        self._last_downloaded: Dict[str, int] = {}
+        # 工作執行緒的 CPU 時間 (不含 ffmpeg / aria2c 子行程)
+        self.cpu_seconds = 0.0
+        # 寫入磁碟的位元組數 (下載的串流與合併 / 封裝輸出)
+        self.bytes_written = 0
+
+    def cancel(self):
+        """取消任務"""
+        self.cancelled = True
+        if self.downloader:
+            self.downloader.cancel()
+
+
+class DownloadEngine:
+    """asyncio 下載引擎
+
+    事件迴圈在獨立執行緒中運行，阻塞的 yt-dlp 呼叫透過 run_in_executor
+    交給各階段的執行緒池，並以 StageLimiter 限制每個階段的同時數量。
+
+    各階段的同時數量可於執行中以 set_limit() 調整 (執行緒池以 MAX_POOL_SIZE
+    為上限按需建立執行緒)，調整後會以 listener('limits', '', 上限) 通知；
+    engine.autotune.AutoTuner 依 stage_stats() 的吞吐量自動呼叫 set_limit()。
+
+    事件以 listener(kind, url, data) 回報，kind 為
+    'title' / 'metadata' / 'status' / 'progress' / 'finished' / 'limits' 之一；
+    供外部程式使用的結構化事件則發布在 event_bus 上。
+    """
+
+    def __init__(
+        self,
+        listener: Optional[Callable[[str, str, dict], None]] = None,
+        max_extractions: int = MAX_CONCURRENT_EXTRACTIONS,
+        max_transfers: int = MAX_CONCURRENT_DOWNLOADS,
+        max_postprocess: int = MAX_CONCURRENT_POSTPROCESS,
+        max_prefetch: int = MAX_CONCURRENT_PREFETCH,
+        thumbnail_cache: Optional[ThumbnailCache] = None,
+        subtitle_cache: Optional[SubtitleCache] = None,
+        ledger: Optional[UsageLedger] = None
+    ):
+        self.listener = listener
+        self.thumbnail_cache = thumbnail_cache
+        self.subtitle_cache = subtitle_cache
+        self.event_bus = EventBus()
+        self.ledger = ledger if ledger is not None else UsageLedger()
+        # 後處理階段: 每個函數接收 DownloadJob，回傳 False 或拋出例外代表失敗
+        self.postprocessors: List[Callable[[DownloadJob], Optional[bool]]] = [
+            DownloadVerifier(self),
+        ]
+        self.jobs: Dict[str, DownloadJob] = {}
+        self._limits = {
+            STAGE_EXTRACT: max_extractions,
+            STAGE_TRANSFER: max_transfers,
+            STAGE_POSTPROCESS: max_postprocess,
+            STAGE_PREFETCH: max_prefetch,
+        }
+        self._stage_counts = {stage: {'completed': 0, 'failed': 0} for stage in self._limits}
+        self.bytes_transferred = 0
+        self._background_tasks = set()
+        self._limiters: Dict[str, StageLimiter] = {}
+        self._owner_limiters: Dict[str, StageLimiter] = {}
+        self._executors: Dict[str, ThreadPoolExecutor] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """啟動事件迴圈執行緒"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._loop = asyncio.new_event_loop()
+            ready = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run_loop, args=(ready,), name='download-engine', daemon=True
+            )
+            self._thread.start()
+        ready.wait()
+
+    def _run_loop(self, ready: threading.Event):
+        """事件迴圈執行緒主體"""
+        asyncio.set_event_loop(self._loop)
+        for stage, limit in self._limits.items():
+            self._limiters[stage] = StageLimiter(limit)
+            self._executors[stage] = ThreadPoolExecutor(
+                max_workers=max(limit, MAX_POOL_SIZE), thread_name_prefix=f'engine-{stage}'
+            )
+        ready.set()
+        self._loop.run_forever()
+
+    def submit(self, job: DownloadJob) -> Future:
+        """提交下載任務，回傳可等待結果的 Future"""
+        self.jobs[job.id] = job
+        self.event_bus.publish(JobEvent(JOB_QUEUED, job.url, job_id=job.id, owner=job.owner))
+        return self.run_coroutine(self._run_job(job))
+
+    def run_coroutine(self, coro) -> Future:
+        """在引擎的事件迴圈中執行協程 (可由任意執行緒呼叫)"""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def cancel(self, key: str):
+        """取消指定任務 (任務 ID，或網址：取消該網址的所有任務)"""
+        job = self.jobs.get(key)
+        if job:
+            job.cancel()
+            return
+        for job in self.jobs_for(key):
+            job.cancel()
+
+    def jobs_for(self, url: str) -> List[DownloadJob]:
+        """網址對應的所有進行中任務"""
+        return [job for job in list(self.jobs.values()) if job.url == url]
+
+    def cancel_all(self):
+        """取消所有任務"""
+        for job in list(self.jobs.values()):
+            job.cancel()
+
+    def shutdown(self, timeout: float = 3.0):
+        """停止引擎 (會先取消所有任務)"""
+        self.cancel_all()
+        if self._thread is None:
+            return
+        for executor in self._executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout)
+        self._thread = None
+        extractor_pool.close_all()
+        dns_cache.uninstall()
+
+    def limits(self) -> Dict[str, int]:
+        """各階段目前的同時數量上限"""
+        return dict(self._limits)
+
+    def set_limit(self, stage: str, limit: int):
+        """調整階段的同時數量上限 (可由任意執行緒呼叫，不影響進行中的工作)"""
+        if stage not in self._limits:
+            raise ValueError(f"未知的階段: {stage}")
+        limit = max(1, min(int(limit), MAX_POOL_SIZE))
+        if self._limits[stage] == limit:
+            return
+        self._limits[stage] = limit
+        if stage in self._limiters:
+            asyncio.run_coroutine_threadsafe(self._limiters[stage].set_limit(limit), self._loop)
+        self.emit('limits', '', self.limits())
+
+    def set_owner_limit(self, owner: str, limit: int):
+        """調整擁有者的同時任務上限 (0 表示不限制，只影響尚未開始的任務)"""
+        limit = max(0, int(limit))
+        self.ledger.set_quota(owner, max_concurrent=limit)
+        limiter = self._owner_limiters.get(owner)
+        if limiter:
+            # 0 表示不限制：放行所有等待中的任務
+            asyncio.run_coroutine_threadsafe(limiter.set_limit(limit or sys.maxsize), self._loop)
+
+    def usage_report(self) -> Dict[str, dict]:
+        """各擁有者的用量與配額，並附上目前執行中 / 等待中的任務數"""
+        report = self.ledger.report()
+        for owner, limiter in self._owner_limiters.items():
+            report.setdefault(owner, {}).update(active=limiter.active, waiting=limiter.waiting)
+        return report
+
+    def stage_stats(self) -> Dict[str, dict]:
+        """各階段的上限、執行中 / 等待中數量與累計完成 / 失敗次數"""
+        stats = {}
+        for stage, limit in self._limits.items():
+            limiter = self._limiters.get(stage)
+            stats[stage] = dict(
+                self._stage_counts[stage],
+                limit=limit,
+                active=limiter.active if limiter else 0,
+                waiting=limiter.waiting if limiter else 0,
+            )
+        return stats
+
+    def emit(self, kind: str, url: str, data: dict):
+        """發送事件"""
+        if self.listener:
+            self.listener(kind, url, data)
+
+    async def run_stage(self, stage: str, func: Callable, *args, job: Union[str, 'DownloadJob'] = ""):
+        """在指定階段的名額與執行緒池中執行阻塞函數
+
+        job 為所屬任務 (CPU 時間計入該任務) 或效能記錄用的名稱
+        """
+        waited = time.perf_counter()
+        label = job.url if isinstance(job, DownloadJob) else job
+        async with self._limiters[stage]:
+            profiler.record(f"wait:{stage}", label, waited, time.perf_counter())
+            try:
+                result = await self._loop.run_in_executor(
+                    self._executors[stage], self._call, stage, job, func, *args
+                )
+            except Exception:
+                self._stage_counts[stage]['failed'] += 1
+                raise
+            self._stage_counts[stage]['completed' if result is not False else 'failed'] += 1
+            return result
+
+    def _call(self, stage: str, job: Union[str, DownloadJob], func: Callable, *args):
+        """於工作執行緒中執行，並將 CPU 時間計入任務"""
+        started = time.thread_time()
+        try:
+            return profiler.call(stage, job.url if isinstance(job, DownloadJob) else job, func, *args)
+        finally:
+            if isinstance(job, DownloadJob):
+                job.cpu_seconds += time.thread_time() - started
+
+    def _owner_limiter(self, owner: str) -> Optional[StageLimiter]:
+        """擁有者的同時任務名額 (未設定上限時回傳 None)"""
+        limiter = self._owner_limiters.get(owner)
+        if limiter is None:
+            limit = self.ledger.max_concurrent(owner)
+            if not limit:
+                return None
+            limiter = self._owner_limiters[owner] = StageLimiter(limit)
+        return limiter
+
+    def _prefetch_thumbnail(self, job: DownloadJob):
+        """在背景預取縮圖，不阻塞任務的後續階段"""
+        if self.thumbnail_cache is None:
+            return
+        key = job.info.get('id') or job.url
+        url = select_thumbnail(job.info)
+        task = self._loop.create_task(self._fetch_thumbnail(job, key, url))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    def _prefetch_subtitles(self, job: DownloadJob):
+        """在預取執行緒池下載字幕，與傳輸同時進行；最終封裝時才等待結果"""
+        if not job.embed_subtitles or self.subtitle_cache is None:
+            return
+        # 只傳入字幕相關欄位，排隊中的預取不保留完整的資訊字典
+        info = {key: job.info[key] for key in ('id', 'subtitles', 'automatic_captions') if key in job.info}
+        future = self._executors[STAGE_PREFETCH].submit(self.subtitle_cache.fetch_for, info)
+
+        def subtitle_source() -> dict:
+            try:
+                return future.result(timeout=120)
+            except Exception:
+                return {}
+
+        job.downloader.subtitle_source = subtitle_source
+
+    async def _fetch_thumbnail(self, job: DownloadJob, key: str, thumbnail_url: str):
+        """下載縮圖至快取並回報路徑"""
+        try:
+            path = await self.run_stage(
+                STAGE_PREFETCH, self.thumbnail_cache.fetch, key, thumbnail_url, job=job
+            )
+        except Exception:
+            return
+        if path:
+            self.emit('metadata', job.url, {'thumbnail_path': path})
+
+    def _on_progress(self, job: DownloadJob, data: dict):
+        """傳輸進度回調 (於傳輸執行緒中呼叫)"""
+        self.emit('progress', job.url, data)
+        status = data.get('status')
+        if status == 'downloading':
+            # 下載位元組數 (依檔案分別累計；同一檔案重新下載時 downloaded 會歸零)
+            downloaded = data.get('downloaded') or 0
+            filename = data.get('filename') or ''
+            last = job._last_downloaded.get(filename, 0)
+            delta = downloaded - last if downloaded >= last else downloaded
+            job._last_downloaded[filename] = downloaded
+            job.bytes_transferred += delta
+            with self._lock:
+                self.bytes_transferred += delta
+            self.event_bus.publish(JobEvent(
+                JOB_PROGRESS, job.url, job_id=job.id,
+                percent=data.get('percent'),
+                downloaded_bytes=data.get('downloaded'),
+                total_bytes=data.get('total'),
+                speed=data.get('speed'),
+                eta=data.get('eta')
+            ))
+        elif status == 'processing' and data.get('postprocessor'):
+            self.event_bus.publish(JobEvent(JOB_MERGING, job.url, job_id=job.id, title=job.title))
+        elif status == 'error':
+            job.error = data.get('error')
+
+    def _transfer(self, job: DownloadJob) -> bool:
+        """傳輸階段 (取得名額後才回報開始)
+
+        排隊時只保留精簡資訊或解析結果已超過 INFO_TTL 時，傳入 None 讓 download() 重新解析
+        """
+        self.event_bus.publish(JobEvent(JOB_STARTED, job.url, job_id=job.id, title=job.title))
+        info = job.info
+        if job.extracted_at is None or time.monotonic() - job.extracted_at > INFO_TTL:
+            info = None
+        try:
+            return job.downloader.download(info)
+        finally:
+            # 只保留精簡資訊，讓大型 formats / fragments 清單可以被釋放
+            job.extracted_at = None
+            job.info = slim_info(job.downloader.info)
+            job.downloader.info = None
+            job.bytes_written += job.downloader.bytes_written
+            job.downloader.bytes_written = 0
+
+    async def _run_job(self, job: DownloadJob) -> bool:
+        """執行單個任務的所有階段"""
+        success = False
+        started = time.perf_counter()
+        try:
+            success = await self._process_as_owner(job)
+        except Exception as e:
+            job.error = str(e)
+            self.emit('status', job.url, {'message': f"下載失敗: {str(e)}"})
+            self.emit('progress', job.url, {'percent': 0, 'status': 'error', 'error': str(e)})
+        finally:
+            self.jobs.pop(job.id, None)
+            self._account(job, success)
+            if success:
+                self.event_bus.publish(JobEvent(
+                    JOB_DONE, job.url, job_id=job.id, title=job.title, percent=100, owner=job.owner,
+                    bytes_written=job.bytes_written
+                ))
+            else:
+                error = "下載已取消" if job.cancelled else (job.error or "未知錯誤")
+                self.event_bus.publish(JobEvent(
+                    JOB_FAILED, job.url, job_id=job.id, title=job.title, error=error, owner=job.owner,
+                    bytes_written=job.bytes_written
+                ))
+            self.emit('finished', job.url, {'success': success, 'bytes_written': job.bytes_written})
+            profiler.record('job', job.url, started, time.perf_counter(), success=success,
+                            bytes_written=job.bytes_written)
+        return success
+
+    def _reject(self, job: DownloadJob, reason: str) -> bool:
+        """因配額不足結束任務"""
+        job.error = reason
+        self.emit('status', job.url, {'message': reason})
+        self.emit('progress', job.url, {'percent': 0, 'status': 'error', 'error': reason})
+        return False
+
+    async def _process_as_owner(self, job: DownloadJob) -> bool:
+        """檢查擁有者配額，並在擁有者的同時任務上限內執行
+
+        配額在排隊前、取得擁有者名額後，以及傳輸前 (預留本任務的估計用量) 各檢查一次。
+        """
+        reason = self.ledger.check_quota(job.owner)
+        if reason:
+            return self._reject(job, reason)
+        limiter = self._owner_limiter(job.owner)
+        if limiter is None:
+            return await self._process(job)
+        if limiter.active >= limiter.limit:
+            self.emit('status', job.url, {'message': f"等待 {job.owner} 的下載名額..."})
+        async with limiter:
+            # 等待名額期間其他任務可能已用掉配額
+            reason = self.ledger.check_quota(job.owner)
+            if reason:
+                return self._reject(job, reason)
+            return await self._process(job)
+
+    def _reserve_quota(self, job: DownloadJob) -> Optional[str]:
+        """傳輸前預留本任務的估計用量，配額不足時回傳原因"""
+        if job.size_estimate is None or job.info is None:
+            # 重新下載或解析失敗：沿用先前的預留，只檢查目前用量
+            return self.ledger.check_quota(job.owner)
+        size = job.size_estimate
+        duration = job.info.get('duration')
+        if job.ranges and duration:
+            # 只下載部分區段
+            size = int(size * min(1.0, sum(end - start for start, end in job.ranges) / duration))
+        return self.ledger.reserve(job.owner, job.id, {'bytes': size, 'disk_bytes': size})
+
+    def _account(self, job: DownloadJob, success: bool):
+        """記錄任務用量並移除預留"""
+        try:
+            self.ledger.record(
+                job.owner, success, job.bytes_transferred, job.cpu_seconds,
+                output_size(job.info) if success else 0, job.bytes_written
+            )
+        except OSError:
+            pass
+        finally:
+            self.ledger.release(job.owner, job.id)
+
+    async def _process(self, job: DownloadJob) -> bool:
+        """解析 → 傳輸 → 後處理"""
+        if job.cancelled:
+            return False
+
+        job.downloader = VideoDownloader(
+            url=job.url,
+            output_path=job.output_path,
+            quality=job.quality,
+            progress_callback=lambda data: self._on_progress(job, data),
+            status_callback=lambda message: self.emit('status', job.url, {'message': message}),
+            use_aria2c=job.use_aria2c,
+            chapters=job.chapters,
+            ranges=job.ranges,
+            precise_cuts=job.precise_cuts,
+            long_mode=job.long_mode,
+            embed_subtitles=job.embed_subtitles,
+            embed_metadata=job.embed_metadata,
+            transcode=job.transcode
+        )
+
+        # 解析階段
+        try:
+            job.info = await self.run_stage(STAGE_EXTRACT, job.downloader.extract_info, job=job)
+            title = job.info.get('title', 'Unknown')
+        except Exception:
+            title = f"未知標題 ({job.url[:30]}...)"
+        job.title = title
+        self.emit('title', job.url, {'title': title})
+
+        if job.info:
+            self.emit('metadata', job.url, {
+                'title': title,
+                'duration': job.info.get('duration') or 0,
+                'uploader': job.info.get('uploader', 'Unknown'),
+            })
+            self._prefetch_thumbnail(job)
+            self._prefetch_subtitles(job)
+            job.size_estimate = estimate_size(job.info)
+            job.extracted_at = time.monotonic()
+            transfer = self._limiters[STAGE_TRANSFER]
+            if transfer.active + transfer.waiting >= transfer.limit:
+                # 需排隊等待下載名額：只保留精簡資訊 (大批次時完整資訊會佔用大量記憶體，
+                # 網址也可能在輪到之前過期)，取得名額後重新解析
+                job.info = slim_info(job.info)
+                job.extracted_at = None
+
+        if job.cancelled:
+            return False
+
+        while True:
+            reason = self._reserve_quota(job)
+            if reason:
+                return self._reject(job, reason)
+            # 傳輸階段 (info 為 None 時 download() 會自行重新解析並回報錯誤)
+            success = await self.run_stage(STAGE_TRANSFER, self._transfer, job, job=job)
+            if not success or job.cancelled:
+                return False
+
+            # 後處理階段
+            if await self._postprocess(job):
+                return True
+
+            # 後處理要求重新下載 (例如驗證失敗)：以新解析的網址只重抓出問題的部分
+            if job.redownload_ranges is None or job.retries >= MAX_REDOWNLOADS or job.cancelled:
+                return False
+            job.retries += 1
+            if job.redownload_ranges:
+                job.downloader.chapters = []
+                job.downloader.ranges = job.redownload_ranges
+            job.redownload_ranges = None
+            job.info = None
+            job.extracted_at = None
+            self.emit('status', job.url, {'message': f"重新下載中 (第 {job.retries} 次)..."})
+
+    async def _postprocess(self, job: DownloadJob) -> bool:
+        """依序執行所有後處理，任一失敗即停止"""
+        for postprocessor in self.postprocessors:
+            if await self.run_stage(STAGE_POSTPROCESS, postprocessor, job, job=job) is False:
+                return False
+        return True
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+自動調整各階段同時數量
+
+定期比較每個階段的吞吐量 (傳輸為每秒位元組數，其他階段為每秒完成數)：
+有工作在等待名額時先增加一個名額，若吞吐量沒有相應提升就退回；
+錯誤率過高或 CPU 滿載時則縮減。只改變放行的名額，不中斷進行中的工作。
+"""
+import asyncio
+import os
+from typing import Dict, Optional
+
+from engine.async_engine import STAGE_EXTRACT, STAGE_TRANSFER, STAGE_POSTPROCESS
+from utils.config import (
+    AUTOTUNE_INTERVAL, AUTOTUNE_MIN_GAIN, AUTOTUNE_MAX_CPU, AUTOTUNE_MAX_ERROR_RATE
+)
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+# CPU 滿載時應縮減的階段 (傳輸主要受網路限制)
+CPU_BOUND_STAGES = (STAGE_EXTRACT, STAGE_POSTPROCESS)
+
+
+def cpu_load() -> Optional[float]:
+    """系統 CPU 使用率 (0~1)，無法取得時回傳 None"""
+    if psutil is not None:
+        return psutil.cpu_percent(interval=None) / 100
+    if hasattr(os, 'getloadavg'):
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    return None
+
+
+class AutoTuner:
+    """依吞吐量、CPU 與錯誤率調整下載引擎各階段的名額"""
+
+    def __init__(
+        self,
+        engine,
+        interval: float = AUTOTUNE_INTERVAL,
+        stages=(STAGE_EXTRACT, STAGE_TRANSFER, STAGE_POSTPROCESS)
+    ):
+        self.engine = engine
+        self.interval = interval
+        self.stages = stages
+        self._previous: Dict[str, dict] = {}
+        self._throughput: Dict[str, float] = {}
+        self._grew: Dict[str, bool] = {}
+        self._hold: Dict[str, int] = {}
+        self._future = None
+
+    @property
+    def running(self) -> bool:
+        return self._future is not None and not self._future.done()
+
+    def start(self):
+        """開始定期調整"""
+        if self.running:
+            return
+        self._previous = self._snapshot()
+        self._throughput.clear()
+        self._grew.clear()
+        self._hold.clear()
+        self._future = self.engine.run_coroutine(self._run())
+
+    def stop(self):
+        """停止調整 (保留目前的名額)"""
+        if self._future is not None:
+            self._future.cancel()
+            self._future = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.step()
+
+    def _snapshot(self) -> Dict[str, dict]:
+        stats = self.engine.stage_stats()
+        stats[STAGE_TRANSFER]['bytes'] = self.engine.bytes_transferred
+        return stats
+
+    def step(self):
+        """比較與上次取樣的差異並調整各階段名額"""
+        current = self._snapshot()
+        cpu = cpu_load()
+        for stage in self.stages:
+            limit = self._decide(stage, self._previous[stage], current[stage], cpu)
+            if limit != current[stage]['limit']:
+                self.engine.set_limit(stage, limit)
+        self._previous = current
+
+    def _decide(self, stage: str, before: dict, after: dict, cpu: Optional[float]) -> int:
+        """回傳階段的新名額"""
+        limit = after['limit']
+        completed = after['completed'] - before['completed']
+        failed = after['failed'] - before['failed']
+        if stage == STAGE_TRANSFER:
+            throughput = (after['bytes'] - before['bytes']) / self.interval
+        else:
+            throughput = completed / self.interval
+        previous = self._throughput.get(stage)
+        self._throughput[stage] = throughput
+        grew, self._grew[stage] = self._grew.get(stage, False), False
+
+        if completed + failed and failed / (completed + failed) > AUTOTUNE_MAX_ERROR_RATE:
+            return limit - 1
+        if cpu is not None and cpu > AUTOTUNE_MAX_CPU:
+            return limit - 1 if stage in CPU_BOUND_STAGES else limit
+        if grew and previous is not None and throughput < previous * (1 + AUTOTUNE_MIN_GAIN):
+            # 上次增加名額沒有帶來明顯提升：退回，並暫緩數次再嘗試
+            self._hold[stage] = 3
+            return limit - 1
+        if self._hold.get(stage):
+            self._hold[stage] -= 1
+            return limit
+        if after['waiting'] > 0:
+            self._grew[stage] = True
+            return limit + 1
+        return limit
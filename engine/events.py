@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""
+結構化事件模組 - 任務事件模型、行程內發布/訂閱與 NDJSON / SSE 串流
+
+發布端永不阻塞：每個訂閱者有獨立的有界佇列，佇列中尚未取走的進度事件
+會被同一任務 (job_id；同一網址可同時有多個任務) 較新的進度事件取代，佇列滿時直接丟棄進度事件；
+生命週期事件 (queued / started / merging / done / failed) 在佇列滿時改為
+丟棄最舊的進度事件 (沒有時丟棄最舊的事件)，佇列長度永不超過上限。
+所有被丟棄 / 取代的事件都計入 dropped。
+"""
+import hmac
+import json
+import socket
+import socketserver
+import threading
+import time
+from collections import deque
+from typing import List, Optional
+
+from engine.accounting import validate_quota
+from utils.config import EVENT_QUEUE_SIZE, EVENT_STREAM_HOST, EVENT_STREAM_PORT, EVENT_CONTROL_TOKEN
+
+
+# 控制端點接受的 Host / Origin 主機名稱 (其餘視為跨站請求或 DNS rebinding)
+LOCAL_HOSTNAMES = ('127.0.0.1', 'localhost', '[::1]')
+
+# 事件類型
+JOB_QUEUED = 'queued'
+JOB_STARTED = 'started'
+JOB_PROGRESS = 'progress'
+JOB_MERGING = 'merging'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+
+class JobEvent:
+    """任務事件"""
+
+    __slots__ = (
+        'type', 'url', 'job_id', 'timestamp', 'title', 'percent', 'downloaded_bytes',
+        'total_bytes', 'speed', 'eta', 'error', 'owner', 'bytes_written',
+    )
+
+    def __init__(
+        self,
+        type: str,
+        url: str,
+        job_id: Optional[str] = None,
+        title: Optional[str] = None,
+        percent: Optional[float] = None,
+        downloaded_bytes: Optional[int] = None,
+        total_bytes: Optional[int] = None,
+        speed: Optional[float] = None,
+        eta: Optional[float] = None,
+        error: Optional[str] = None,
+        owner: Optional[str] = None,
+        bytes_written: Optional[int] = None
+    ):
+        self.type = type
+        self.url = url
+        self.job_id = job_id
+        self.timestamp = time.time()
+        self.title = title
+        self.percent = percent
+        self.downloaded_bytes = downloaded_bytes
+        self.total_bytes = total_bytes
+        self.speed = speed
+        self.eta = eta
+        self.error = error
+        self.owner = owner
+        self.bytes_written = bytes_written
+
+    def to_dict(self) -> dict:
+        """轉為字典 (省略空欄位)"""
+        return {
+            key: getattr(self, key)
+            for key in self.__slots__
+            if getattr(self, key) is not None
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False)
+
+
+class Subscription:
+    """單個訂閱者的有界事件佇列"""
+
+    def __init__(self, bus: 'EventBus', maxsize: int = EVENT_QUEUE_SIZE):
+        self.bus = bus
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def put(self, event: JobEvent):
+        """加入事件 (不阻塞)"""
+        with self._cond:
+            if event.type == JOB_PROGRESS:
+                # 以最新進度取代同一任務尚未送出的進度
+                for i, pending in enumerate(self._queue):
+                    if pending.type == JOB_PROGRESS and pending.job_id == event.job_id and pending.url == event.url:
+                        self._queue[i] = event
+                        self.dropped += 1
+                        return
+                if len(self._queue) >= self.maxsize:
+                    self.dropped += 1
+                    return
+            elif len(self._queue) >= self.maxsize:
+                # 停滯的訂閱者：騰出空間給生命週期事件，避免佇列無限增長
+                self._evict_oldest()
+            self._queue.append(event)
+            self._cond.notify()
+
+    def _evict_oldest(self):
+        """丟棄最舊的進度事件，沒有時丟棄最舊的事件 (須持有鎖)"""
+        for i, pending in enumerate(self._queue):
+            if pending.type == JOB_PROGRESS:
+                del self._queue[i]
+                break
+        else:
+            self._queue.popleft()
+        self.dropped += 1
+
+    def get(self, timeout: Optional[float] = None) -> Optional[JobEvent]:
+        """取出下一個事件，逾時或已關閉時回傳 None"""
+        with self._cond:
+            if not self._queue and not self._closed:
+                self._cond.wait(timeout)
+            if self._queue:
+                return self._queue.popleft()
+            return None
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def close(self):
+        """取消訂閱"""
+        self.bus.unsubscribe(self)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class EventBus:
+    """行程內事件發布/訂閱"""
+
+    def __init__(self):
+        self._subscribers: List[Subscription] = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, maxsize: int = EVENT_QUEUE_SIZE) -> Subscription:
+        subscription = Subscription(self, maxsize)
+        with self._lock:
+            self._subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+
+    def publish(self, event: JobEvent):
+        """發布事件給所有訂閱者"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.put(event)
+
+
+class _EventStreamHandler(socketserver.StreamRequestHandler):
+    """連線處理：/limits、/usage 為名額與用量控制，HTTP GET 回應 SSE，其餘連線輸出 NDJSON"""
+
+    def handle(self):
+        first_line = self.rfile.readline(1024) if self._has_request() else b''
+        parts = first_line.split()
+        if len(parts) >= 2 and parts[1] in (b'/limits', b'/usage'):
+            self._handle_control(parts[1], parts[0], self._read_headers())
+            return
+        sse = first_line.startswith(b'GET ')
+        if sse:
+            self._read_headers()
+            self.wfile.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/event-stream; charset=utf-8\r\n"
+                b"Cache-Control: no-cache\r\n"
+                b"Connection: keep-alive\r\n\r\n"
+            )
+
+        subscription = self.server.bus.subscribe()
+        try:
+            while not self.server.stopping.is_set():
+                event = subscription.get(timeout=15)
+                if event is None:
+                    # 保持連線 (SSE 註解 / NDJSON 空行)
+                    payload = b": keep-alive\n\n" if sse else b"\n"
+                elif sse:
+                    payload = f"event: {event.type}\ndata: {event.to_json()}\n\n".encode('utf-8')
+                else:
+                    payload = (event.to_json() + "\n").encode('utf-8')
+                self.wfile.write(payload)
+                self.wfile.flush()
+        except OSError:
+            pass
+        finally:
+            subscription.close()
+
+    def _read_headers(self) -> dict:
+        """讀完其餘 HTTP 標頭"""
+        headers = {}
+        while True:
+            line = self.rfile.readline(1024)
+            if line in (b'\r\n', b'\n', b''):
+                return headers
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+    def _handle_control(self, path: bytes, method: bytes, headers: dict):
+        """/limits：GET 回傳各階段名額與統計，POST {"transfer": 8, ...} 調整名額
+        /usage：GET 回傳各擁有者用量與配額，POST {"team-a": {"max_concurrent": 2}} 調整配額
+        """
+        control = self.server.control
+        status = '200 OK'
+        rejected = self._reject_control(method, headers)
+        if rejected:
+            status, body = rejected
+        elif control is None:
+            status, body = '404 Not Found', {'error': "未提供名額控制"}
+        else:
+            try:
+                changes = {}
+                if method == b'POST':
+                    length = int(headers.get('content-length') or 0)
+                    changes = json.loads(self.rfile.read(length) or b'{}')
+                if path == b'/limits':
+                    for stage, limit in changes.items():
+                        control.set_limit(stage, limit)
+                    body = control.stage_stats()
+                else:
+                    if not isinstance(changes, dict):
+                        raise ValueError("內容必須為 {擁有者: 配額} 物件")
+                    # 先檢查全部內容，任一不合法時完全不套用
+                    changes = {owner: validate_quota(quota) for owner, quota in changes.items()}
+                    for owner, quota in changes.items():
+                        if 'max_concurrent' in quota:
+                            control.set_owner_limit(owner, quota.pop('max_concurrent'))
+                        control.ledger.set_quota(owner, **quota)
+                    body = control.usage_report()
+            except (ValueError, TypeError, AttributeError) as e:
+                status, body = '400 Bad Request', {'error': str(e)}
+        payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.wfile.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: close\r\n\r\n".encode('ascii') + payload
+        )
+
+    def _reject_control(self, method: bytes, headers: dict) -> Optional[tuple]:
+        """檢查控制請求來源與權杖，拒絕時回傳 (狀態, 內容)
+
+        瀏覽器中的任何網頁都能對本機連接埠發出請求，因此：
+        Host / Origin 必須是本機位址，POST 必須為 application/json
+        (跨站表單無法不經 CORS 預檢送出) 並帶有設定的權杖。
+        """
+        port = self.server.port
+        host = headers.get('host', '')
+        if host and host.rsplit(':', 1)[0] not in LOCAL_HOSTNAMES:
+            return '403 Forbidden', {'error': "不允許的 Host"}
+        origin = headers.get('origin')
+        if origin is not None and origin not in {f"http://{name}:{port}" for name in LOCAL_HOSTNAMES}:
+            return '403 Forbidden', {'error': "不允許跨來源請求"}
+        if method == b'GET':
+            return None
+        if method != b'POST':
+            return '405 Method Not Allowed', {'error': "只支援 GET / POST"}
+        if headers.get('content-type', '').split(';')[0].strip().lower() != 'application/json':
+            return '415 Unsupported Media Type', {'error': "需要 Content-Type: application/json"}
+        token = self.server.control_token
+        if not token:
+            return '403 Forbidden', {'error': "未設定 EVENT_CONTROL_TOKEN，無法修改"}
+        if not hmac.compare_digest(headers.get('authorization', ''), f"Bearer {token}"):
+            return '401 Unauthorized', {'error': "權杖錯誤"}
+        return None
+
+    def _has_request(self) -> bool:
+        """NDJSON 客戶端可能不送任何資料，短暫等待請求行"""
+        self.connection.settimeout(0.5)
+        try:
+            return bool(self.connection.recv(1, socket.MSG_PEEK))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(None)
+
+
+class EventStreamServer(socketserver.ThreadingTCPServer):
+    """本機事件串流伺服器"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(
+        self, bus: EventBus, host: str = '127.0.0.1', port: int = 0, control=None,
+        control_token: str = EVENT_CONTROL_TOKEN
+    ):
+        super().__init__((host, port), _EventStreamHandler)
+        self.bus = bus
+        # 提供 stage_stats() / set_limit() 的物件 (下載引擎)，供 /limits 使用
+        self.control = control
+        # 修改名額 / 配額所需的權杖
+        self.control_token = control_token
+        self.stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self):
+        """在背景執行緒中開始服務"""
+        self._thread = threading.Thread(target=self.serve_forever, name='event-stream', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止服務"""
+        self.stopping.set()
+        self.shutdown()
+        self.server_close()
+
+
+def start_event_stream(
+    bus: EventBus, host: str = EVENT_STREAM_HOST, port: int = EVENT_STREAM_PORT, control=None
+) -> Optional[EventStreamServer]:
+    """啟動事件串流伺服器，port 為 0 或無法綁定時回傳 None"""
+    if not port:
+        return None
+    try:
+        server = EventStreamServer(bus, host, port, control)
+    except OSError as e:
+        print(f"無法啟動事件串流 ({host}:{port}): {e}")
+        return None
+    server.start()
+    return server
@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+"""
+內建多連線分段下載器 - 未安裝 aria2c 時使用
+
+將 HTTP(S) 串流依位元組範圍切成多段，以執行緒池搭配持久連線同時下載，
+並預先配置輸出檔案大小，各段直接寫入對應的偏移位置。
+
+某條連線的速度持續遠低於其他連線時 (例如被分配到緩慢的 CDN 節點)，
+會重新解析取得同一格式的新網址，並從該段目前的位置繼續下載。比較基準除了
+同一檔案的其他連線，也包含行程內其他下載最近的速度，因此整個任務都落在同一個
+緩慢節點時也能發現。此機制只用於內建下載器，aria2c 下載時不適用。
+"""
+import http.client
+import os
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+from yt_dlp.downloader.common import FileDownloader
+from yt_dlp.downloader.http import HttpFD
+
+from engine.network import extract_info
+from engine.postprocess import FinalizeYoutubeDL
+from utils.config import (
+    PARALLEL_DOWNLOAD_CONNECTIONS, PARALLEL_CHUNK_SIZE, SLOW_CONNECTION_RATIO,
+    SLOW_CONNECTION_GRACE, SLOW_CONNECTION_MIN_PEERS, SLOW_CONNECTION_FLOOR, MAX_URL_REFRESHES
+)
+
+
+# 讀取緩衝區大小
+READ_BLOCK_SIZE = 64 * 1024
+
+# 每段最多重試次數
+MAX_RANGE_RETRIES = 3
+
+
+class SlowConnection(Exception):
+    """連線速度低於其他連線的下限"""
+
+
+class ThroughputBaseline:
+    """行程共用的速度基準：各下載器最近完成各段的速度"""
+
+    def __init__(self, maxlen: int = 64):
+        self._rates = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def record(self, source: int, host: str, rate: float):
+        with self._lock:
+            self._rates.append((source, host, rate))
+
+    def others(self, source: int, host: str) -> List[float]:
+        """其他下載器 (其他任務 / 檔案) 或其他主機的速度"""
+        with self._lock:
+            return [rate for s, h, rate in self._rates if s != source or h != host]
+
+
+throughput_baseline = ThroughputBaseline()
+
+
+def preallocate(f, size: int):
+    """預先配置檔案大小 (支援時使用 fallocate 取得連續空間)"""
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+            return
+        except OSError:
+            pass
+    f.truncate(size)
+
+
+class ConnectionPool:
+    """每個執行緒、每個主機各保留一條 keep-alive 連線"""
+
+    def __init__(self, timeout: float = 20.0):
+        self.timeout = timeout
+        self._local = threading.local()
+        self._all: List[http.client.HTTPConnection] = []
+        self._lock = threading.Lock()
+
+    def _connections(self) -> Dict[Tuple[str, str], http.client.HTTPConnection]:
+        if not hasattr(self._local, 'connections'):
+            self._local.connections = {}
+        return self._local.connections
+
+    def get(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        """取得 (或建立) 目前執行緒對該主機的連線"""
+        connections = self._connections()
+        key = (scheme, netloc)
+        conn = connections.get(key)
+        if conn is None:
+            conn_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+            conn = conn_class(netloc, timeout=self.timeout)
+            connections[key] = conn
+            with self._lock:
+                self._all.append(conn)
+        return conn
+
+    def discard(self, scheme: str, netloc: str):
+        """關閉並移除發生錯誤的連線"""
+        conn = self._connections().pop((scheme, netloc), None)
+        if conn:
+            conn.close()
+
+    def close_all(self):
+        """關閉所有執行緒建立的連線"""
+        with self._lock:
+            for conn in self._all:
+                conn.close()
+            self._all.clear()
+
+
+class ParallelHttpFD(FileDownloader):
+    """多連線分段 HTTP 下載器"""
+
+    @staticmethod
+    def can_download(info_dict: dict) -> bool:
+        """是否適用於此格式 (單一 HTTP(S) 檔案，非片段 / 非區段下載)"""
+        return (
+            info_dict.get('protocol') in ('http', 'https')
+            and not info_dict.get('fragments')
+            and 'section_start' not in info_dict
+            and 'section_end' not in info_dict
+        )
+
+    def __init__(self, ydl, params):
+        super().__init__(ydl, params)
+        self.connections = params.get('parallel_connections') or PARALLEL_DOWNLOAD_CONNECTIONS
+        self.chunk_size = params.get('parallel_chunk_size') or PARALLEL_CHUNK_SIZE
+        self._pool = ConnectionPool()
+        self._lock = threading.Lock()
+        self._abort = threading.Event()
+        # 目前使用的網址 (慢速連線更換網址後所有連線共用)、進行中各段的速度
+        # 與最近完成各段的速度 (分段很快完成時仍有比較基準)
+        self._url = ''
+        self._info: dict = {}
+        self._total = 0
+        self._refreshes = 0
+        self._refresh_lock = threading.Lock()
+        self._rates: Dict[int, float] = {}
+        self._recent_rates = deque(maxlen=self.connections * 2)
+
+    def _headers(self, info_dict: dict) -> dict:
+        """請求標頭 (yt-dlp 不把 Cookie 放在 http_headers，需從共用 cookiejar 取得)"""
+        headers = dict(info_dict.get('http_headers') or {})
+        cookies = self.ydl.cookiejar.get_cookies_for_url(info_dict['url'])
+        if cookies:
+            headers['Cookie'] = '; '.join(f'{cookie.name}={cookie.value}' for cookie in cookies)
+        return headers
+
+    def _request(self, method: str, url: str, headers: dict) -> http.client.HTTPResponse:
+        """發送請求並跟隨重新導向，回傳回應物件"""
+        for _ in range(5):
+            parts = urlsplit(url)
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            conn = self._pool.get(parts.scheme, parts.netloc)
+            try:
+                conn.request(method, path, headers=headers)
+                response = conn.getresponse()
+            except (http.client.HTTPException, OSError):
+                # keep-alive 連線可能已被伺服器關閉，重新連線再試一次
+                self._pool.discard(parts.scheme, parts.netloc)
+                conn = self._pool.get(parts.scheme, parts.netloc)
+                conn.request(method, path, headers=headers)
+                response = conn.getresponse()
+            if response.status in (301, 302, 303, 307, 308):
+                response.read()
+                url = urljoin(url, response.getheader('Location'))
+                continue
+            return response
+        raise http.client.HTTPException("重新導向次數過多")
+
+    def _probe_size(self, url: str, headers: dict) -> Optional[int]:
+        """以 1 位元組的範圍請求確認伺服器支援分段，並取得總大小"""
+        response = self._request('GET', url, dict(headers, Range='bytes=0-0'))
+        response.read()
+        content_range = response.getheader('Content-Range', '')
+        if response.status != 206 or '/' not in content_range:
+            return None
+        total = content_range.rsplit('/', 1)[1]
+        return int(total) if total.isdigit() else None
+
+    def _fetch_range(self, headers: dict, tmpfilename: str, start: int, end: int, progress: dict):
+        """下載單一範圍並寫入檔案對應位置 (重試或更換網址時從目前位置繼續)"""
+        offset = start
+        attempt = 0
+        while True:
+            url = self._url
+            parts = urlsplit(url)
+            try:
+                response = self._request('GET', url, dict(headers, Range=f'bytes={offset}-{end}'))
+                if response.status != 206:
+                    response.read()
+                    raise http.client.HTTPException(f"HTTP {response.status}")
+                started = time.monotonic()
+                next_check = started + 1.0
+                received = 0
+                with open(tmpfilename, 'r+b') as f:
+                    f.seek(offset)
+                    while offset <= end:
+                        if self._abort.is_set():
+                            return
+                        block = response.read(min(READ_BLOCK_SIZE, end - offset + 1))
+                        if not block:
+                            break
+                        f.write(block)
+                        offset += len(block)
+                        received += len(block)
+                        self._report_progress(len(block), progress)
+                        now = time.monotonic()
+                        if now >= next_check and offset <= end:
+                            next_check = now + 1.0
+                            self._check_speed(start, received / (now - started), now - started, parts.netloc)
+                if offset > end:
+                    rate = received / max(time.monotonic() - started, 1e-3)
+                    with self._lock:
+                        self._recent_rates.append(rate)
+                    throughput_baseline.record(id(self), parts.netloc, rate)
+                    return
+                raise http.client.IncompleteRead(b'', end - offset + 1)
+            except SlowConnection:
+                # 未讀完的回應無法重複使用，關閉連線後以 (可能更新的) 網址繼續
+                self._pool.discard(parts.scheme, parts.netloc)
+                self._replace_url(url)
+            except Exception:
+                attempt += 1
+                if self._abort.is_set() or attempt >= MAX_RANGE_RETRIES:
+                    raise
+                self._pool.discard(parts.scheme, parts.netloc)
+            finally:
+                with self._lock:
+                    self._rates.pop(start, None)
+
+    def _check_speed(self, key: int, rate: float, elapsed: float, host: str):
+        """記錄此段的速度，持續低於比較基準中位數的一定比例時拋出 SlowConnection
+
+        比較基準為同一檔案的其他連線與其他下載 / 主機的速度；
+        設定 SLOW_CONNECTION_FLOOR 時，所有連線合計低於下限也視為慢速
+        """
+        with self._lock:
+            self._rates[key] = rate
+            combined = sum(self._rates.values())
+            peers = [r for k, r in self._rates.items() if k != key] + list(self._recent_rates)
+        if elapsed < SLOW_CONNECTION_GRACE or self._refreshes >= MAX_URL_REFRESHES:
+            return
+        if SLOW_CONNECTION_FLOOR and combined < SLOW_CONNECTION_FLOOR:
+            raise SlowConnection(f"{combined / 1024:.0f} KiB/s (合計)")
+        peers += throughput_baseline.others(id(self), host)
+        if len(peers) >= SLOW_CONNECTION_MIN_PEERS and rate < statistics.median(peers) * SLOW_CONNECTION_RATIO:
+            raise SlowConnection(f"{rate / 1024:.0f} KiB/s")
+
+    def _replace_url(self, old_url: str):
+        """重新解析取得同一格式的新網址 (其他連線已更換過時直接沿用)"""
+        with self._refresh_lock:
+            if self._url != old_url or self._refreshes >= MAX_URL_REFRESHES:
+                return
+            self._refreshes += 1
+            self.to_screen("[parallel] 連線速度過慢，重新取得下載網址...")
+            try:
+                new_url = self.ydl.refresh_format_url(self._info)
+                # 確認新網址指向相同大小的內容
+                if new_url and self._probe_size(new_url, self._headers(dict(self._info, url=new_url))) == self._total:
+                    self._url = new_url
+            except Exception as e:
+                self.report_warning(f"無法取得新的下載網址: {e}")
+
+    def _report_progress(self, delta: int, progress: dict):
+        """累計已下載位元組並觸發 yt-dlp 進度回調"""
+        with self._lock:
+            progress['downloaded_bytes'] += delta
+            now = time.time()
+            # 每 0.2 秒最多回報一次，避免大量回調
+            if delta > 0 and now - progress['last_report'] < 0.2:
+                return
+            progress['last_report'] = now
+            downloaded = progress['downloaded_bytes']
+            total = progress['total_bytes']
+            status = {
+                'status': 'downloading',
+                'downloaded_bytes': downloaded,
+                'total_bytes': total,
+                'filename': progress['filename'],
+                'tmpfilename': progress['tmpfilename'],
+                'elapsed': now - progress['start'],
+                'speed': self.calc_speed(progress['start'], now, downloaded),
+                'eta': self.calc_eta(progress['start'], now, total, downloaded),
+            }
+            try:
+                self._hook_progress(status, progress['info_dict'])
+            except Exception:
+                # 進度回調拋出例外 (例如使用者取消) 時停止所有連線
+                self._abort.set()
+                raise
+
+    def real_download(self, filename: str, info_dict: dict) -> bool:
+        """執行分段下載"""
+        url = info_dict['url']
+        headers = self._headers(info_dict)
+        tmpfilename = self.temp_name(filename)
+
+        total = self._probe_size(url, headers)
+        if not total:
+            # 伺服器不支援範圍請求，改用 yt-dlp 預設下載器 (沿用進度回調：進度、完成事件與取消)
+            fd = HttpFD(self.ydl, self.params)
+            for hook in self._progress_hooks:
+                if hook != self.report_progress:
+                    fd.add_progress_hook(hook)
+            return fd.real_download(filename, info_dict)
+        self._url = url
+        self._info = info_dict
+        self._total = total
+
+        self.report_destination(filename)
+        with open(tmpfilename, 'wb') as f:
+            preallocate(f, total)
+
+        ranges: List[Tuple[int, int]] = [
+            (start, min(start + self.chunk_size, total) - 1)
+            for start in range(0, total, self.chunk_size)
+        ]
+        progress = {
+            'downloaded_bytes': 0,
+            'total_bytes': total,
+            'filename': filename,
+            'tmpfilename': tmpfilename,
+            'start': time.time(),
+            'last_report': 0.0,
+            'info_dict': info_dict,
+        }
+
+        workers = min(self.connections, len(ranges))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fragment') as executor:
+            futures = [
+                executor.submit(self._fetch_range, headers, tmpfilename, start, end, progress)
+                for start, end in ranges
+            ]
+            try:
+                for future in futures:
+                    future.result()
+            except BaseException:
+                self._abort.set()
+                for future in futures:
+                    future.cancel()
+                raise
+            finally:
+                self._pool.close_all()
+
+        # 節流可能略過最後一段的進度：完成前補報一次完整進度
+        self._report_progress(0, progress)
+        self.try_rename(tmpfilename, filename)
+        self._hook_progress({
+            'downloaded_bytes': total,
+            'total_bytes': total,
+            'filename': filename,
+            'status': 'finished',
+            'elapsed': time.time() - progress['start'],
+        }, info_dict)
+        return True
+
+
+class ParallelYoutubeDL(FinalizeYoutubeDL):
+    """對單一 HTTP(S) 串流改用內建多連線下載器的 YoutubeDL"""
+
+    def refresh_format_url(self, info: dict) -> Optional[str]:
+        """重新解析取得同一格式的新網址 (可能分配到其他 CDN 節點)"""
+        webpage_url = info.get('webpage_url')
+        if not webpage_url or not info.get('format_id'):
+            return None
+        opts = {'quiet': True, 'no_warnings': True}
+        if self.params.get('live_from_start'):
+            opts['live_from_start'] = True
+        # 在分段下載執行緒中呼叫，不使用解析執行緒的 YoutubeDL 快取
+        fresh = extract_info(webpage_url, opts, pooled=False)
+        for fmt in fresh.get('formats') or []:
+            if fmt.get('format_id') == info['format_id'] and fmt.get('url'):
+                return fmt['url']
+        return None
+
+    def fetch(self, name, info, subtitle=False, test=False):
+        # 內建下載器直接使用 http.client：設定代理或略過憑證檢查時交給 yt-dlp
+        if (subtitle or test or not info.get('url') or not ParallelHttpFD.can_download(info)
+                or self.params.get('proxy') or self.params.get('nocheckcertificate')):
+            return super().fetch(name, info, subtitle, test)
+        # 與 YoutubeDL.dl 相同：加入進度回調並計算請求標頭
+        fd = ParallelHttpFD(self, self.params)
+        for hook in self._progress_hooks:
+            fd.add_progress_hook(hook)
+        new_info = self._copy_infodict(info)
+        if new_info.get('http_headers') is None:
+            new_info['http_headers'] = self._calc_headers(new_info)
+        return fd.download(name, new_info)
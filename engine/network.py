@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+共用網路層 - 解析 (extract) 階段的連線重用、DNS 快取與延遲統計
+
+每次建立新的 YoutubeDL 都會產生新的 request handler，連線池也跟著重建，
+所以每次解析都要重新做 DNS 查詢、TCP 與 TLS 握手。這裡讓每個解析執行緒
+保留自己的 YoutubeDL (依選項區分)，其 request handler 的 keep-alive 連線池
+在不同任務間持續使用；DNS 結果則以行程共用、有上限的 TTL / LRU 快取保存，
+引擎停止時還原原本的 socket.getaddrinfo。
+"""
+import socket
+import statistics
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List
+
+import yt_dlp
+
+from engine.replay import harness
+from engine.session import session_manager
+from utils.config import NETWORK_POOLING, DNS_CACHE_TTL, DNS_CACHE_SIZE
+
+
+class DNSCache:
+    """行程共用的 getaddrinfo 快取 (TTL 到期或超過筆數上限時淘汰)"""
+
+    def __init__(self, ttl: float = DNS_CACHE_TTL, max_entries: int = DNS_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._cache: 'OrderedDict[tuple, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._original = None
+
+    def install(self):
+        """以快取版本取代 socket.getaddrinfo"""
+        with self._lock:
+            if self._original is not None:
+                return
+            self._original = socket.getaddrinfo
+            socket.getaddrinfo = self._getaddrinfo
+
+    def uninstall(self):
+        """還原 socket.getaddrinfo"""
+        with self._lock:
+            if self._original is None:
+                return
+            socket.getaddrinfo = self._original
+            self._original = None
+            self._cache.clear()
+
+    def _getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        key = (host, port, family, type, proto, flags)
+        now = time.monotonic()
+        with self._lock:
+            original = self._original or socket.getaddrinfo
+            cached = self._cache.get(key)
+            if cached and cached[0] > now:
+                self._cache.move_to_end(key)
+                return list(cached[1])
+        result = original(host, port, family, type, proto, flags)
+        with self._lock:
+            self._cache[key] = (now + self.ttl, tuple(result))
+            self._cache.move_to_end(key)
+            self._evict(now)
+        return result
+
+    def _evict(self, now: float):
+        """移除過期項目，仍超過上限時淘汰最久未使用的 (須持有鎖)"""
+        if len(self._cache) <= self.max_entries:
+            return
+        for key in [k for k, (expires, _) in self._cache.items() if expires <= now]:
+            del self._cache[key]
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+
+class LatencyMetrics:
+    """解析延遲統計 (依標籤分組，例如 pooled / unpooled)"""
+
+    def __init__(self, max_samples: int = 1000):
+        self.max_samples = max_samples
+        self._samples: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, label: str, seconds: float):
+        with self._lock:
+            samples = self._samples.setdefault(label, [])
+            samples.append(seconds)
+            if len(samples) > self.max_samples:
+                del samples[0]
+
+    def summary(self) -> Dict[str, dict]:
+        """各標籤的次數、平均、中位數與 p95 (秒)"""
+        with self._lock:
+            result = {}
+            for label, samples in self._samples.items():
+                ordered = sorted(samples)
+                result[label] = {
+                    'count': len(ordered),
+                    'mean': statistics.fmean(ordered),
+                    'p50': ordered[len(ordered) // 2],
+                    'p95': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                }
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+
+
+class ExtractorPool:
+    """每個執行緒依選項保留一個可重複使用的 YoutubeDL"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._all: List[yt_dlp.YoutubeDL] = []
+        self._lock = threading.Lock()
+
+    def get(self, ydl_opts: dict) -> yt_dlp.YoutubeDL:
+        """取得目前執行緒對應選項的 YoutubeDL"""
+        if not hasattr(self._local, 'instances'):
+            self._local.instances = {}
+        key = tuple(sorted((k, repr(v)) for k, v in ydl_opts.items()))
+        ydl = self._local.instances.get(key)
+        if ydl is None:
+            ydl = session_manager.attach(yt_dlp.YoutubeDL(ydl_opts))
+            self._local.instances[key] = ydl
+            with self._lock:
+                self._all.append(ydl)
+        return ydl
+
+    def close_all(self):
+        """關閉所有執行緒的 YoutubeDL 與其連線"""
+        with self._lock:
+            for ydl in self._all:
+                ydl.close()
+            self._all.clear()
+        self._local = threading.local()
+
+
+dns_cache = DNSCache()
+network_metrics = LatencyMetrics()
+extractor_pool = ExtractorPool()
+
+
+def extract_info(url: str, ydl_opts: dict, pooled: bool = NETWORK_POOLING) -> dict:
+    """解析影片資訊 (受共用請求預算限制) 並記錄延遲"""
+    if harness.replaying:
+        return harness.load_info(url)
+    session_manager.acquire(url)
+    start = time.perf_counter()
+    try:
+        if pooled:
+            info = extractor_pool.get(ydl_opts).extract_info(url, download=False)
+        else:
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                info = session_manager.attach(ydl).extract_info(url, download=False)
+    except Exception as e:
+        session_manager.report(url, e)
+        raise
+    finally:
+        network_metrics.record('pooled' if pooled else 'unpooled', time.perf_counter() - start)
+        session_manager.save_cookies()
+    session_manager.report(url)
+    if harness.recording:
+        harness.save_info(url, info, time.perf_counter() - start)
+    return info
+
+
+def compare_extraction_latency(urls: List[str], rounds: int = 3) -> Dict[str, dict]:
+    """交替以共用 / 不共用連線解析同一批連結，回傳延遲統計"""
+    ydl_opts = {'quiet': True, 'no_warnings': True}
+    network_metrics.reset()
+    for _ in range(rounds):
+        for url in urls:
+            extract_info(url, ydl_opts, pooled=False)
+            extract_info(url, ydl_opts, pooled=True)
+    return network_metrics.summary()
+
+
+if __name__ == '__main__':
+    import sys
+
+    dns_cache.install()
+    try:
+        for label, stats in compare_extraction_latency(sys.argv[1:]).items():
+            print(f"{label:>9}: n={stats['count']} mean={stats['mean']:.3f}s "
+                  f"p50={stats['p50']:.3f}s p95={stats['p95']:.3f}s")
+    finally:
+        dns_cache.uninstall()
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+最終封裝後處理 - 以單次 ffmpeg 完成 MP4 封裝、字幕、章節與標籤嵌入
+
+取代 FFmpegVideoRemuxer + FFmpegEmbedSubtitle + FFmpegMetadata 的組合，
+每個輸出檔案最多只重寫一次；已是 MP4 且無需嵌入任何內容時直接略過。
+選擇轉檔設定且來源非 H.264 時，在同一次 ffmpeg 中以 x264 轉檔。
+
+分開下載的音視訊串流不再先由 FFmpegMergerPP 合併成暫存 MP4，而是直接作為
+這次 ffmpeg 的輸入 (FinalizeYoutubeDL 略過合併步驟)，輸出寫到目標資料夾中
+以 fallocate 預先配置空間的暫存檔，完成後改名；每部影片只寫入一次完整檔案。
+"""
+import ctypes
+import os
+from typing import Callable, Dict, List, Optional
+
+from yt_dlp.postprocessor.ffmpeg import FFmpegMergerPP, FFmpegPostProcessor
+from yt_dlp.utils import prepend_extension
+
+from engine.stream_store import StoreYoutubeDL
+from engine.transcode import needs_transcode, transcode_slot, video_args
+from utils.config import PREALLOCATE_OUTPUT
+
+try:
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _fallocate = getattr(_libc, 'fallocate64', None) or _libc.fallocate
+    _fallocate.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64)
+except (OSError, TypeError, AttributeError):
+    _fallocate = None
+
+
+# fallocate(2) 模式：配置空間但不改變檔案大小 (ffmpeg 寫入時檔案大小照常增加)
+FALLOC_FL_KEEP_SIZE = 0x01
+
+
+def preallocate(path: str, size: int) -> bool:
+    """建立 path 並預先配置 size 位元組的空間，不支援或空間不足時回傳 False"""
+    if _fallocate is None or size <= 0:
+        return False
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        return _fallocate(fd, FALLOC_FL_KEEP_SIZE, 0, size) == 0
+    finally:
+        os.close(fd)
+
+
+def _escape_metadata(value) -> str:
+    """ffmetadata 格式的跳脫"""
+    text = str(value)
+    for char in ('\\', '=', ';', '#', '\n'):
+        text = text.replace(char, '\\' + char)
+    return text
+
+
+def build_ffmetadata(info: dict, chapters: bool = True) -> str:
+    """產生包含標籤與章節的 ffmetadata 內容"""
+    tags = {
+        'title': info.get('title'),
+        'artist': info.get('uploader') or info.get('channel'),
+        'date': info.get('upload_date'),
+        'description': info.get('description'),
+        'comment': info.get('webpage_url'),
+    }
+    lines = [';FFMETADATA1']
+    lines += [f"{key}={_escape_metadata(value)}" for key, value in tags.items() if value]
+    if chapters:
+        for chapter in info.get('chapters') or []:
+            lines += [
+                '[CHAPTER]',
+                'TIMEBASE=1/1000',
+                f"START={int(chapter['start_time'] * 1000)}",
+                f"END={int(chapter['end_time'] * 1000)}",
+                f"title={_escape_metadata(chapter.get('title') or '')}",
+            ]
+    return '\n'.join(lines) + '\n'
+
+
+class FFmpegFinalizePP(FFmpegPostProcessor):
+    """單次 ffmpeg 完成 MP4 封裝、音訊 AAC、字幕 / 章節 / 標籤嵌入"""
+
+    def __init__(
+        self,
+        downloader=None,
+        embed_metadata: bool = True,
+        subtitle_source: Optional[Callable[[], Dict[str, str]]] = None,
+        transcode: Optional[dict] = None
+    ):
+        super().__init__(downloader)
+        self.embed_metadata = embed_metadata
+        self.subtitle_source = subtitle_source
+        self.transcode = transcode
+
+    def set_downloader(self, downloader):
+        """建構時與 add_post_processor 都會呼叫：避免重複加入後處理回調"""
+        self._downloader = downloader
+        for hook in getattr(downloader, '_postprocessor_hooks', []):
+            if hook not in self._progress_hooks:
+                self.add_progress_hook(hook)
+
+    def _audio_args(self, info: dict) -> list:
+        """已合併的檔案音訊已轉為 AAC；單一檔案則依來源編碼決定是否轉檔"""
+        acodec = info.get('acodec') or ''
+        if info.get('requested_formats') or acodec.startswith('mp4a') or acodec == 'none':
+            return ['-c:a', 'copy']
+        return ['-c:a', 'aac', '-b:a', '192k']
+
+    def _merge_args(self, info: dict) -> List[str]:
+        """直接合併分開下載的串流：逐一對應音視訊，非 AAC 音訊轉為 AAC"""
+        opts = []
+        audio_streams = 0
+        for index, fmt in enumerate(info['requested_formats']):
+            if fmt.get('vcodec') != 'none':
+                opts += ['-map', f'{index}:v:0']
+            if fmt.get('acodec') != 'none':
+                opts += ['-map', f'{index}:a:0']
+                if (fmt.get('acodec') or '').startswith('mp4a'):
+                    opts += [f'-c:a:{audio_streams}', 'copy']
+                    if (fmt.get('protocol') or '').startswith('m3u8'):
+                        # HLS 的 ADTS AAC 放入 MP4 需轉換
+                        opts += [f'-bsf:a:{audio_streams}', 'aac_adtstoasc']
+                else:
+                    opts += [f'-c:a:{audio_streams}', 'aac', f'-b:a:{audio_streams}', '192k']
+                audio_streams += 1
+        return opts
+
+    def run(self, info):
+        filename = info['filepath']
+        is_section = 'section_start' in info
+        subtitles = {}
+        if self.subtitle_source and not is_section:
+            subtitles = self.subtitle_source() or {}
+
+        # 尚未合併的串流 (FinalizeYoutubeDL 略過了 FFmpegMergerPP)
+        merge_files = info.pop('__files_to_merge', None) if info.get('__merge_in_finalize') else None
+        transcode = bool(self.transcode) and needs_transcode(info)
+        if (not merge_files and info.get('ext') == 'mp4'
+                and not subtitles and not self.embed_metadata and not transcode):
+            self.to_screen("已是 MP4 且無需嵌入內容，略過封裝")
+            return [], info
+
+        out_path = os.path.splitext(filename)[0] + '.mp4'
+        temp_path = prepend_extension(out_path, 'temp')
+        if merge_files:
+            inputs = list(merge_files)
+            opts = self._merge_args(info)
+            opts += video_args(self.transcode) if transcode else ['-c:v', 'copy']
+        else:
+            inputs = [filename]
+            opts = ['-map', '0:v?', '-map', '0:a?']
+            opts += video_args(self.transcode) if transcode else ['-c:v', 'copy']
+            opts += self._audio_args(info)
+        media_inputs = len(inputs)
+
+        for index, (lang, path) in enumerate(subtitles.items()):
+            inputs.append(path)
+            opts += ['-map', f'{len(inputs) - 1}:0', f'-metadata:s:s:{index}', f'language={lang}']
+        if subtitles:
+            opts += ['-c:s', 'mov_text']
+
+        metadata_path = None
+        if self.embed_metadata:
+            metadata_path = os.path.splitext(out_path)[0] + '.meta.txt'
+            with open(metadata_path, 'w', encoding='utf-8') as f:
+                f.write(build_ffmetadata(info, chapters=not is_section))
+            inputs.append(metadata_path)
+            meta_index = str(len(inputs) - 1)
+            opts += ['-map_metadata', meta_index, '-map_chapters', meta_index]
+
+        opts += ['-movflags', '+faststart']
+
+        # 以輸入大小預先配置暫存檔 (與輸出同一資料夾，完成後直接改名)；
+        # -truncate 0 讓 ffmpeg 沿用預先配置的空間而不是截斷重建
+        if PREALLOCATE_OUTPUT and preallocate(temp_path, sum(os.path.getsize(path) for path in inputs[:media_inputs])):
+            opts += ['-truncate', '0']
+
+        if transcode:
+            self.to_screen(f"轉檔為 H.264 ({self.transcode['preset']}, CRF {self.transcode['crf']})")
+        if merge_files:
+            self.to_screen(f"合併 {len(merge_files)} 個串流並封裝 MP4")
+        self.to_screen(f"封裝 MP4 並嵌入 {len(subtitles)} 個字幕 / 章節 / 標籤")
+        try:
+            if transcode:
+                # 限制同時轉檔數，避免多個 ffmpeg 互搶 CPU
+                with transcode_slot():
+                    self.run_ffmpeg_multiple_files(inputs, temp_path, opts)
+            else:
+                self.run_ffmpeg_multiple_files(inputs, temp_path, opts)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        finally:
+            if metadata_path and os.path.exists(metadata_path):
+                os.remove(metadata_path)
+
+        # 釋放多配置但未使用的空間
+        os.truncate(temp_path, os.path.getsize(temp_path))
+        os.replace(temp_path, out_path)
+        # 重新編碼 (x264 或音訊轉為 AAC) 後大小與來源不同，驗證時不比對大小
+        info['reencoded'] = transcode or 'aac' in opts
+        if merge_files:
+            info['filepath'] = out_path
+            info['ext'] = 'mp4'
+            return list(merge_files), info
+        if out_path != filename:
+            os.remove(filename)
+        info['filepath'] = out_path
+        info['ext'] = 'mp4'
+        return [], info
+
+
+class FinalizeYoutubeDL(StoreYoutubeDL):
+    """由 FFmpegFinalizePP 直接合併分開下載的串流，略過 FFmpegMergerPP 的 YoutubeDL"""
+
+    def run_all_pps(self, key, info, *, additional_pps=None):
+        finalizer = next((pp for pp in self._pps.get(key, []) if isinstance(pp, FFmpegFinalizePP)), None)
+        pps = list(additional_pps or [])
+        merger = next((pp for pp in pps if isinstance(pp, FFmpegMergerPP)), None)
+        if key != 'post_process' or finalizer is None or merger is None:
+            return super().run_all_pps(key, info, additional_pps=additional_pps)
+
+        # 合併前的後處理照常執行；合併改由最終封裝完成，
+        # 原本排在合併之後的修正 (例如長寬比) 則於封裝後執行
+        index = pps.index(merger)
+        info['__merge_in_finalize'] = True
+        info = super().run_all_pps(key, info, additional_pps=pps[:index])
+        info.pop('__merge_in_finalize', None)
+        for pp in pps[index + 1:]:
+            info = self.run_pp(pp, info)
+        return info
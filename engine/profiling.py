@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+效能分析模式 - 記錄每個任務各階段的時間區段
+
+啟用後 (命令列 --profile 或環境變數 YTDL_PROFILE=輸出路徑)，解析、格式選擇、
+傳輸 (含 aria2c / ffmpeg 子行程)、合併與封裝、後處理以及 Qt 信號處理都會
+記錄為時間區段，結束時寫入 Chrome trace JSON (可用 chrome://tracing 或
+ui.perfetto.dev 開啟)，並輸出最慢階段的摘要。
+
+另可選用 cProfile 或 pyinstrument 取樣工作執行緒 (--profile-sampler)。
+未啟用時所有記錄函數皆直接返回。
+"""
+import atexit
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+from utils.config import PROFILE_TRACE_PATH, PROFILE_SAMPLER
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+
+SAMPLERS = ('cprofile', 'pyinstrument')
+
+
+class Profiler:
+    """行程共用的時間區段記錄器"""
+
+    def __init__(self):
+        self.enabled = False
+        self.trace_path = ""
+        self.sampler = ""
+        self._events: List[dict] = []
+        self._threads: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self._stats: Optional[pstats.Stats] = None
+        self._session = None
+
+    def enable(self, trace_path: str, sampler: str = ""):
+        """啟用記錄，程式結束時寫入 trace_path"""
+        if sampler and sampler not in SAMPLERS:
+            raise ValueError(f"未知的取樣器: {sampler}")
+        if sampler == 'pyinstrument' and pyinstrument is None:
+            print("未安裝 pyinstrument，改用 cProfile 取樣")
+            sampler = 'cprofile'
+        with self._lock:
+            if self.enabled:
+                return
+            self.enabled = True
+            self.trace_path = trace_path
+            self.sampler = sampler
+        atexit.register(self.finish)
+
+    def record(self, name: str, job: str, start: float, end: float, **args):
+        """加入已完成的區段 (start / end 為 time.perf_counter() 值)"""
+        if not self.enabled:
+            return
+        thread = threading.current_thread()
+        event = {
+            'name': name,
+            'cat': name.split(':', 1)[0],
+            'ph': 'X',
+            'ts': (start - self._origin) * 1e6,
+            'dur': (end - start) * 1e6,
+            'pid': os.getpid(),
+            'tid': thread.ident,
+            'args': dict(args, job=job),
+        }
+        with self._lock:
+            self._events.append(event)
+            self._threads.setdefault(thread.ident, thread.name)
+
+    @contextmanager
+    def span(self, name: str, job: str = "", **args):
+        """記錄區塊執行時間"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, job, start, time.perf_counter(), **args)
+
+    def traced(self, name: str):
+        """裝飾器：以第一個參數 (任務網址) 記錄方法執行時間"""
+        def decorator(func: Callable):
+            @functools.wraps(func)
+            def wrapper(instance, job, *args, **kwargs):
+                with self.span(name, job):
+                    return func(instance, job, *args, **kwargs)
+            return wrapper
+        return decorator
+
+    def call(self, name: str, job: str, func: Callable, *args):
+        """在目前執行緒執行函數並記錄區段 (依設定同時取樣)"""
+        if not self.enabled:
+            return func(*args)
+        with self.span(name, job):
+            if self.sampler == 'cprofile':
+                return self._call_cprofile(func, *args)
+            if self.sampler == 'pyinstrument':
+                return self._call_pyinstrument(func, *args)
+            return func(*args)
+
+    def _call_cprofile(self, func: Callable, *args):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12 起同一時間只能有一個 cProfile，其他執行緒取樣中時略過
+            return func(*args)
+        try:
+            return func(*args)
+        finally:
+            profile.disable()
+            with self._lock:
+                if self._stats is None:
+                    self._stats = pstats.Stats(profile)
+                else:
+                    self._stats.add(profile)
+
+    def _call_pyinstrument(self, func: Callable, *args):
+        sampler = pyinstrument.Profiler(interval=0.001, async_mode='disabled')
+        sampler.start()
+        try:
+            return func(*args)
+        finally:
+            session = sampler.stop()
+            with self._lock:
+                if self._session is None:
+                    self._session = session
+                else:
+                    self._session = pyinstrument.session.Session.combine(self._session, session)
+
+    def summary(self, top: int = 10) -> str:
+        """最慢階段摘要：各階段總計 / 平均 / 最長時間與最慢的單一區段"""
+        with self._lock:
+            events = list(self._events)
+        stages: Dict[str, List[float]] = {}
+        for event in events:
+            stages.setdefault(event['name'], []).append(event['dur'] / 1e6)
+
+        lines = ["階段                          次數     總計(s)   平均(s)   最長(s)"]
+        ranked = sorted(stages.items(), key=lambda item: sum(item[1]), reverse=True)
+        for name, durations in ranked[:top]:
+            lines.append(
+                f"{name:<28} {len(durations):>6} {sum(durations):>10.2f} "
+                f"{sum(durations) / len(durations):>9.3f} {max(durations):>9.3f}"
+            )
+        lines.append("")
+        lines.append("最慢的區段:")
+        for event in sorted(events, key=lambda e: e['dur'], reverse=True)[:top]:
+            lines.append(f"  {event['dur'] / 1e6:8.2f}s  {event['name']}  {event['args'].get('job', '')}")
+        return '\n'.join(lines)
+
+    def write_trace(self, path: str):
+        """寫入 Chrome trace JSON"""
+        with self._lock:
+            events = list(self._events)
+            threads = dict(self._threads)
+        metadata = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': name}}
+            for tid, name in threads.items()
+        ]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+
+    def finish(self):
+        """寫入 trace、取樣結果與摘要 (程式結束時自動呼叫)"""
+        if not self.enabled:
+            return
+        self.enabled = False
+        base = os.path.splitext(self.trace_path)[0]
+        self.write_trace(self.trace_path)
+        if self._stats is not None:
+            self._stats.dump_stats(base + '.prof')
+            report = io.StringIO()
+            self._stats.stream = report
+            self._stats.sort_stats('cumulative').print_stats(30)
+            with open(base + '.cprofile.txt', 'w', encoding='utf-8') as f:
+                f.write(report.getvalue())
+        if self._session is not None:
+            from pyinstrument.renderers import HTMLRenderer
+            with open(base + '.pyinstrument.html', 'w', encoding='utf-8') as f:
+                f.write(HTMLRenderer().render(self._session))
+
+        summary = self.summary()
+        with open(base + '.summary.txt', 'w', encoding='utf-8') as f:
+            f.write(summary + '\n')
+        print(f"效能記錄已寫入 {self.trace_path}")
+        print(summary)
+
+
+profiler = Profiler()
+
+if PROFILE_TRACE_PATH:
+    profiler.enable(PROFILE_TRACE_PATH, PROFILE_SAMPLER)
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+"""
+錄製 / 重播 - 不連網重現下載流程
+
+錄製模式 (--record 目錄 或 YTDL_RECORD_DIR) 會把解析結果 (含解析延遲) 與
+下載完成的串流保存到 fixture 目錄。重播模式 (--replay 目錄 或 YTDL_REPLAY_DIR)
+則從 fixture 讀取解析結果，並以本機 HTTP 伺服器 (支援範圍請求、可限速) 提供
+串流，讓同一條 download() 路徑 (格式選擇、分段下載、合併、封裝、驗證) 在
+沒有網路的環境下以固定速度重現。
+
+以 `python -m engine.replay fixture目錄` 在重播模式下執行整批任務，並輸出
+延遲、吞吐量、進度事件數與記憶體峰值，可用於 CI 的效能回歸比較。
+"""
+import argparse
+import hashlib
+import http.server
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+from urllib.parse import quote, unquote
+
+from engine.stream_store import StreamStore, link_file
+from utils.config import RECORD_DIR, REPLAY_DIR, REPLAY_BANDWIDTH, REPLAY_TIME_SCALE
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# 重播時移除的欄位 (縮圖與字幕需要連網)
+OFFLINE_STRIP_KEYS = ('thumbnail', 'thumbnails', 'subtitles', 'automatic_captions')
+
+# 串流傳送區塊大小
+SEND_BLOCK_SIZE = 64 * 1024
+
+
+class _MediaHandler(http.server.BaseHTTPRequestHandler):
+    """提供 fixture 串流的 HTTP 處理 (支援 Range 與限速)"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body: bool):
+        path = os.path.normpath(os.path.join(self.server.root, unquote(self.path.lstrip('/'))))
+        if not path.startswith(self.server.root) or not os.path.isfile(path):
+            self.send_error(404)
+            return
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        range_header = self.headers.get('Range', '')
+        if range_header.startswith('bytes='):
+            first, _, last = range_header[6:].partition('-')
+            start = int(first) if first else max(0, size - int(last))
+            end = min(int(last), size - 1) if first and last else size - 1
+            if start > end:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        if send_body:
+            self._send_range(path, start, end)
+
+    def _send_range(self, path: str, start: int, end: int):
+        """依設定的頻寬傳送 (每條連線)"""
+        bandwidth = self.server.bandwidth
+        sent = 0
+        began = time.monotonic()
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                block = f.read(min(SEND_BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                try:
+                    self.wfile.write(block)
+                except OSError:
+                    return
+                remaining -= len(block)
+                sent += len(block)
+                if bandwidth:
+                    delay = sent / bandwidth - (time.monotonic() - began)
+                    if delay > 0:
+                        time.sleep(delay)
+
+
+class MediaServer(http.server.ThreadingHTTPServer):
+    """本機串流伺服器"""
+
+    daemon_threads = True
+
+    def __init__(self, root: str, bandwidth: int = REPLAY_BANDWIDTH):
+        super().__init__(('127.0.0.1', 0), _MediaHandler)
+        self.root = os.path.abspath(root)
+        self.bandwidth = bandwidth
+        self._thread = threading.Thread(target=self.serve_forever, name='replay-media', daemon=True)
+        self._thread.start()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/"
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class ReplayHarness:
+    """行程共用的錄製 / 重播狀態"""
+
+    def __init__(self):
+        self.mode = ''
+        self.root = ''
+        self.time_scale = REPLAY_TIME_SCALE
+        self.server: Optional[MediaServer] = None
+        self._lock = threading.Lock()
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == 'record'
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == 'replay'
+
+    def enable(self, mode: str, root: str, bandwidth: int = REPLAY_BANDWIDTH, time_scale: float = REPLAY_TIME_SCALE):
+        """啟用錄製 ('record') 或重播 ('replay')"""
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"未知的模式: {mode}")
+        self.disable()
+        self.mode = mode
+        self.root = root
+        self.time_scale = time_scale
+        os.makedirs(os.path.join(root, 'streams'), exist_ok=True)
+        if mode == 'replay':
+            self.server = MediaServer(os.path.join(root, 'streams'), bandwidth)
+
+    def disable(self):
+        if self.server:
+            self.server.stop()
+            self.server = None
+        self.mode = ''
+
+    def _info_path(self, url: str) -> str:
+        name = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.root, f"{name}.info.json")
+
+    def index(self) -> Dict[str, str]:
+        """已錄製的連結 {網址: 標題}"""
+        path = os.path.join(self.root, 'index.json')
+        if not os.path.isfile(path):
+            return {}
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def save_info(self, url: str, info: dict, latency: float):
+        """保存解析結果與解析延遲"""
+        import yt_dlp
+
+        data = {'url': url, 'latency': latency, 'info': yt_dlp.YoutubeDL.sanitize_info(info)}
+        with self._lock:
+            with open(self._info_path(url), 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            index = self.index()
+            index[url] = info.get('title', '')
+            with open(os.path.join(self.root, 'index.json'), 'w', encoding='utf-8') as f:
+                json.dump(index, f, ensure_ascii=False, indent=2)
+
+    def save_stream(self, info: Optional[dict], filename: str):
+        """保存下載完成的串流"""
+        key = StreamStore.key_for(info or {})
+        if not key or not os.path.isfile(filename):
+            return
+        path = os.path.join(self.root, 'streams', key)
+        if os.path.isfile(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 不使用硬連結：輸出檔案之後被修改時不影響 fixture
+        link_file(filename, path + '.tmp', allow_hardlink=False)
+        os.replace(path + '.tmp', path)
+
+    def load_info(self, url: str) -> dict:
+        """讀取解析結果，格式網址改為本機串流伺服器 (只保留已錄製串流的格式)"""
+        path = self._info_path(url)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"沒有錄製的解析結果: {url}")
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if self.time_scale:
+            time.sleep(data.get('latency', 0) * self.time_scale)
+
+        info = data['info']
+        for key in OFFLINE_STRIP_KEYS + ('requested_formats', 'requested_downloads', 'url'):
+            info.pop(key, None)
+        formats = []
+        for fmt in info.get('formats') or []:
+            key = StreamStore.key_for(dict(fmt, id=info.get('id'), extractor_key=info.get('extractor_key')))
+            if not key or not os.path.isfile(os.path.join(self.root, 'streams', key)):
+                continue
+            for field in ('fragments', 'manifest_url', 'fragment_base_url', 'downloader_options'):
+                fmt.pop(field, None)
+            fmt['url'] = self.server.base_url + quote(key.replace(os.sep, '/'))
+            fmt['protocol'] = 'http'
+            formats.append(fmt)
+        info['formats'] = formats
+        return info
+
+
+harness = ReplayHarness()
+
+if REPLAY_DIR:
+    harness.enable('replay', REPLAY_DIR)
+elif RECORD_DIR:
+    harness.enable('record', RECORD_DIR)
+
+
+def peak_memory() -> int:
+    """行程的最大常駐記憶體 (bytes)，無法取得時回傳 0"""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 以 bytes 回報，Linux 以 KiB 回報
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run_replay(root: str, output_path: str, bandwidth: int = REPLAY_BANDWIDTH, time_scale: float = REPLAY_TIME_SCALE) -> dict:
+    """以重播模式執行 fixture 中所有連結，回傳延遲、吞吐量、事件數與記憶體峰值"""
+    from engine.async_engine import DownloadEngine, DownloadJob
+    from engine.accounting import UsageLedger
+    from engine.events import JOB_PROGRESS
+
+    harness.enable('replay', root, bandwidth, time_scale)
+    urls = list(harness.index())
+    engine = DownloadEngine(ledger=UsageLedger(path=''))
+
+    # 與實際訂閱者相同，在任務進行中持續讀取事件
+    subscription = engine.event_bus.subscribe()
+    counts = {'events': 0, 'progress_events': 0}
+    finished = threading.Event()
+
+    def consume():
+        while True:
+            event = subscription.get(timeout=0.1)
+            if event is None:
+                if finished.is_set():
+                    return
+                continue
+            counts['events'] += 1
+            counts['progress_events'] += event.type == JOB_PROGRESS
+
+    consumer = threading.Thread(target=consume, name='replay-events', daemon=True)
+    consumer.start()
+
+    started = time.perf_counter()
+    jobs = [DownloadJob(url, output_path, verify=True) for url in urls]
+    futures = [(job, time.perf_counter(), engine.submit(job)) for job in jobs]
+    latencies = []
+    failed = []
+    for job, submitted, future in futures:
+        if not future.result():
+            failed.append(job.url)
+        latencies.append(time.perf_counter() - submitted)
+    elapsed = time.perf_counter() - started
+
+    finished.set()
+    consumer.join()
+    engine.event_bus.unsubscribe(subscription)
+    engine.shutdown()
+    harness.disable()
+
+    total_bytes = sum(job.bytes_transferred for job in jobs)
+    bytes_written = sum(job.bytes_written for job in jobs)
+    latencies.sort()
+    return {
+        'jobs': len(jobs),
+        'failed': failed,
+        'elapsed': elapsed,
+        'bytes_transferred': total_bytes,
+        'throughput': total_bytes / elapsed if elapsed else 0.0,
+        'bytes_written': bytes_written,
+        'write_amplification': bytes_written / total_bytes if total_bytes else 0.0,
+        'latency_p50': latencies[len(latencies) // 2] if latencies else 0.0,
+        'latency_max': latencies[-1] if latencies else 0.0,
+        'events': counts['events'],
+        'progress_events': counts['progress_events'],
+        'peak_memory': peak_memory(),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令列入口：重播 fixture 目錄並輸出效能數據"""
+    parser = argparse.ArgumentParser(description="以重播模式執行錄製的下載並輸出效能數據")
+    parser.add_argument('root', help="錄製 (--record) 產生的 fixture 目錄")
+    parser.add_argument('--bandwidth', type=int, default=REPLAY_BANDWIDTH,
+                        help="每條連線的頻寬 (bytes/s)，0 表示不限速")
+    parser.add_argument('--time-scale', type=float, default=REPLAY_TIME_SCALE,
+                        help="解析延遲的倍數，0 表示立即回應")
+    args = parser.parse_args(argv)
+
+    output = tempfile.mkdtemp(prefix='ytdl-replay-')
+    try:
+        result = run_replay(args.root, output, args.bandwidth, args.time_scale)
+    finally:
+        shutil.rmtree(output, ignore_errors=True)
+    print(f"任務: {result['jobs']} (失敗 {len(result['failed'])})  耗時: {result['elapsed']:.2f}s")
+    print(f"吞吐量: {result['throughput'] / 1024 / 1024:.2f} MiB/s  "
+          f"延遲 p50 / 最長: {result['latency_p50']:.2f}s / {result['latency_max']:.2f}s")
+    print(f"寫入: {result['bytes_written'] / 1024 / 1024:.1f} MiB "
+          f"(下載量的 {result['write_amplification']:.2f} 倍)")
+    print(f"事件: {result['events']} (進度 {result['progress_events']})  "
+          f"記憶體峰值: {result['peak_memory'] / 1024 / 1024:.1f} MiB")
+    return 1 if result['failed'] else 0
+
+
+if __name__ == '__main__':
+    # 以 -m 執行時本模組是 __main__，與 engine.network / downloader 匯入的
+    # engine.replay 是不同的模組物件；改用 engine.replay 的 main，重播才會生效
+    from engine.replay import main as replay_main
+    sys.exit(replay_main())
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+共用工作階段管理 - Cookie、各網站的解析請求預算與斷路器
+
+所有 YoutubeDL 實例共用同一個 Cookie jar (各實例不再自行讀寫 Cookie 檔)，
+一個實例取得的登入 / 同意 Cookie 其他實例立即可用，寫回檔案時以鎖序列化。
+
+所有解析請求先向所屬網站的令牌桶 (token bucket) 取得額度。遇到 429 或
+機器人驗證時斷路器跳脫，整個解析池暫停一段時間 (連續跳脫時加倍)，
+恢復後以減半的速率重新開始，每次成功再逐步加回，避免所有任務同時重試。
+"""
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+from yt_dlp.cookies import YoutubeDLCookieJar, load_cookies
+
+from utils.config import (
+    COOKIE_FILE, COOKIES_FROM_BROWSER, EXTRACT_RATE, EXTRACT_BURST,
+    BREAKER_COOLDOWN, BREAKER_MAX_COOLDOWN
+)
+
+
+# 代表被限流或要求驗證的錯誤訊息
+RATE_LIMIT_MARKERS = (
+    'HTTP Error 429',
+    'Too Many Requests',
+    'confirm you’re not a bot',
+    "confirm you're not a bot",
+    'rate-limited',
+)
+
+
+def site_key(url: str) -> str:
+    """將網址歸類到網站 (例如 youtu.be 與 www.youtube.com 同屬 youtube)"""
+    host = (urlsplit(url).hostname or '').lower()
+    if host in ('youtu.be',) or host.endswith('youtube.com'):
+        return 'youtube'
+    parts = host.split('.')
+    return '.'.join(parts[-2:]) if len(parts) >= 2 else host
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    """判斷例外是否為限流 / 機器人驗證"""
+    message = str(error)
+    return any(marker in message for marker in RATE_LIMIT_MARKERS)
+
+
+class SiteBudget:
+    """單一網站的令牌桶與斷路器"""
+
+    def __init__(self, rate: float = EXTRACT_RATE, burst: int = EXTRACT_BURST):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.open_until = 0.0
+        self.trips = 0
+        self._cond = threading.Condition()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """取得一個請求額度 (阻塞直到斷路器關閉且有令牌)"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if now < self.open_until:
+                    self._cond.wait(self.open_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                self._cond.wait((1 - self.tokens) / self.rate)
+
+    def success(self):
+        """請求成功：逐步恢復速率 (加法增加)"""
+        with self._cond:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+            else:
+                self.trips = 0
+
+    def trip(self) -> float:
+        """遇到限流：暫停整個網站並將速率減半，回傳暫停秒數"""
+        with self._cond:
+            now = time.monotonic()
+            if now < self.open_until:
+                # 同一波失敗只計算一次
+                return self.open_until - now
+            cooldown = min(BREAKER_MAX_COOLDOWN, BREAKER_COOLDOWN * (2 ** self.trips))
+            self.trips += 1
+            self.open_until = now + cooldown
+            self.rate = max(self.max_rate / 16, self.rate / 2)
+            self.tokens = 0
+            self.updated = self.open_until
+            return cooldown
+
+    @property
+    def paused(self) -> bool:
+        return time.monotonic() < self.open_until
+
+
+class SessionManager:
+    """所有下載器共用的 Cookie 與請求預算"""
+
+    def __init__(self):
+        self._budgets: Dict[str, SiteBudget] = {}
+        self._lock = threading.Lock()
+        self._cookiejar: Optional[YoutubeDLCookieJar] = None
+        self._cookie_lock = threading.Lock()
+
+    def budget(self, url: str) -> SiteBudget:
+        key = site_key(url)
+        with self._lock:
+            if key not in self._budgets:
+                self._budgets[key] = SiteBudget()
+            return self._budgets[key]
+
+    def attach(self, ydl):
+        """讓 YoutubeDL 改用共用的 Cookie jar (須在發出任何請求前呼叫)"""
+        with self._cookie_lock:
+            if self._cookiejar is None:
+                browser = (COOKIES_FROM_BROWSER,) if COOKIES_FROM_BROWSER else None
+                cookie_file = None if browser else (COOKIE_FILE or None)
+                self._cookiejar = load_cookies(cookie_file, browser, ydl)
+            ydl.cookiejar = self._cookiejar
+        return ydl
+
+    def save_cookies(self):
+        """將共用 Cookie jar 寫回 Cookie 檔 (從瀏覽器讀取時不寫回)"""
+        if COOKIES_FROM_BROWSER or not COOKIE_FILE or self._cookiejar is None:
+            return
+        # 鎖住 jar 本身，避免其他執行緒在寫出途中加入 Cookie
+        with self._cookie_lock, self._cookiejar._cookies_lock:
+            self._cookiejar.save()
+
+    def acquire(self, url: str):
+        """解析前取得額度"""
+        self.budget(url).acquire()
+
+    def report(self, url: str, error: Optional[BaseException] = None) -> float:
+        """回報解析結果，遇到限流時回傳暫停秒數 (否則為 0)"""
+        budget = self.budget(url)
+        if error is None:
+            budget.success()
+            return 0.0
+        if is_rate_limited(error):
+            return budget.trip()
+        return 0.0
+
+    def paused(self, url: str) -> bool:
+        """該網站目前是否暫停解析"""
+        return self.budget(url).paused
+
+
+session_manager = SessionManager()
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+串流去重存放區 - 以影片 ID 與格式 ID 保存已下載的音視訊串流
+
+同一部影片以不同畫質或下載到不同資料夾時，已下載過的串流 (例如相同的
+音訊) 直接從存放區取得，不再重新下載。放入與取出皆優先使用 reflink
+(寫入時複製)。硬連結與存放區共用同一個 inode，輸出檔案被就地修改 (加標籤等)
+時會連帶改壞存放區，因此只用於合併前的中間檔 (.f<格式 ID>.，合併後即刪除)；
+最終輸出不支援 reflink 時取出改為複製，也不以硬連結放入存放區。
+"""
+import glob
+import os
+import re
+import shutil
+import threading
+from typing import Dict, Optional
+
+import yt_dlp
+
+from utils.config import STREAM_STORE, STREAM_STORE_DIR, STREAM_STORE_MAX_BYTES
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# Linux FICLONE ioctl (btrfs / XFS / bcachefs 等支援 reflink 的檔案系統)
+FICLONE = 0x40049409
+
+# 每個 YoutubeDL 都有自己的 StreamStore：同一存放區目錄共用一把鎖
+_root_locks: Dict[str, threading.Lock] = {}
+_root_locks_guard = threading.Lock()
+
+
+def _lock_for(root: str) -> threading.Lock:
+    with _root_locks_guard:
+        return _root_locks.setdefault(os.path.abspath(root), threading.Lock())
+
+
+def reflink(src: str, dst: str) -> bool:
+    """以 reflink 建立共用資料區塊的副本，不支援時回傳 False"""
+    if fcntl is None:
+        return False
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return True
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        return False
+
+
+def link_file(src: str, dst: str, allow_copy: bool = True, allow_hardlink: bool = True) -> Optional[str]:
+    """以 reflink / 硬連結 / 複製建立 dst，回傳使用的方式；皆失敗時回傳 None"""
+    if reflink(src, dst):
+        return 'reflink'
+    if allow_hardlink:
+        try:
+            os.link(src, dst)
+            return 'hardlink'
+        except OSError:
+            pass
+    if allow_copy:
+        shutil.copyfile(src, dst)
+        return 'copy'
+    return None
+
+
+class StreamStore:
+    """依 (網站, 影片 ID, 格式 ID) 保存串流檔案的存放區"""
+
+    def __init__(self, root: str = STREAM_STORE_DIR, max_bytes: int = STREAM_STORE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = _lock_for(root)
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def key_for(info: dict) -> Optional[str]:
+        """串流的鍵；片段下載、直播或缺少 ID 時回傳 None"""
+        if not info.get('id') or not info.get('format_id') or not info.get('ext'):
+            return None
+        if 'section_start' in info or info.get('is_live'):
+            return None
+        return StreamStore._base_key(info, info['format_id']) + '.' + info['ext']
+
+    @staticmethod
+    def is_intermediate(info: dict, filename: str) -> bool:
+        """是否為合併前的單一格式中間檔 (yt-dlp 命名為 <名稱>.f<格式 ID>.<副檔名>)"""
+        return f".f{info.get('format_id')}." in os.path.basename(filename)
+
+    @staticmethod
+    def _base_key(info: dict, format_id: str) -> str:
+        parts = (info.get('extractor_key') or 'generic', info['id'], format_id)
+        safe = [re.sub(r'[^A-Za-z0-9_.-]', '_', str(part)) for part in parts]
+        return os.path.join(*safe)
+
+    def lookup(self, info: dict) -> Optional[str]:
+        """已保存的串流路徑 (大小與資訊不符時視為無效)"""
+        key = self.key_for(info)
+        if not key:
+            return None
+        path = os.path.join(self.root, key)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return None
+        expected = info.get('filesize')
+        if size == 0 or (expected and size != expected):
+            return None
+        # 以修改時間記錄最近使用，供淘汰判斷
+        os.utime(path)
+        return path
+
+    def place(self, info: dict, filename: str) -> Optional[str]:
+        """將已保存的串流放到 filename，回傳使用的方式；未保存時回傳 None
+
+        持有存放區的鎖，連結 / 複製途中不會被淘汰
+        """
+        with self._lock:
+            path = self.lookup(info)
+            if not path:
+                return None
+            os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+            tmp_path = filename + '.store'
+            method = link_file(path, tmp_path, allow_hardlink=self.is_intermediate(info, filename))
+            os.replace(tmp_path, filename)
+            return method
+
+    def put(self, info: dict, filename: str) -> Optional[str]:
+        """保存剛下載的串流 (只用 reflink / 硬連結，不額外佔用空間)"""
+        key = self.key_for(info)
+        if not key or not os.path.isfile(filename):
+            return None
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        method = link_file(
+            filename, tmp_path, allow_copy=False, allow_hardlink=self.is_intermediate(info, filename)
+        )
+        if method:
+            os.replace(tmp_path, path)
+            self._evict()
+        return method
+
+    def discard(self, info: dict):
+        """移除影片的串流 (例如輸出檔案驗證失敗時)；合併格式 "137+140" 也會移除各個串流"""
+        if not info.get('id') or not info.get('format_id'):
+            return
+        format_ids = {str(info['format_id'])} | set(str(info['format_id']).split('+'))
+        with self._lock:
+            for format_id in format_ids:
+                pattern = os.path.join(self.root, glob.escape(self._base_key(info, format_id))) + '.*'
+                for path in glob.glob(pattern):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    def _evict(self):
+        """淘汰最久未使用的串流直到總大小低於上限"""
+        with self._lock:
+            entries = []
+            total = 0
+            for dirpath, _, names in os.walk(self.root):
+                for name in names:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+
+class StoreYoutubeDL(yt_dlp.YoutubeDL):
+    """下載串流前先查詢存放區，下載完成後放入存放區的 YoutubeDL"""
+
+    def __init__(self, params=None, *args, **kwargs):
+        super().__init__(params, *args, **kwargs)
+        store = self.params.get('stream_store', STREAM_STORE)
+        self.stream_store: Optional[StreamStore] = StreamStore() if store is True else (store or None)
+
+    def fetch(self, name, info, subtitle=False, test=False):
+        """實際下載 (子類別可覆寫以更換下載器)，回傳 (是否成功, 是否實際下載)"""
+        return super().dl(name, info, subtitle, test)
+
+    def dl(self, name, info, subtitle=False, test=False):
+        if self.stream_store is None or subtitle or test:
+            return self.fetch(name, info, subtitle, test)
+
+        method = self.stream_store.place(info, name)
+        if method:
+            size = os.path.getsize(name)
+            self.to_screen(f"[store] 使用已下載的串流 {info.get('format_id')} ({method}): {name}")
+            for hook in self._progress_hooks:
+                hook({
+                    'status': 'finished',
+                    'filename': name,
+                    'downloaded_bytes': size,
+                    'total_bytes': size,
+                    'info_dict': info,
+                    'stored': method,
+                })
+            return True, False
+
+        success, real_download = self.fetch(name, info, subtitle, test)
+        if success:
+            try:
+                self.stream_store.put(info, name)
+            except OSError as e:
+                self.report_warning(f"無法保存串流至存放區: {e}")
+        return success, real_download
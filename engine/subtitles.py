@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+字幕預取模組 - 依影片與語言快取字幕檔
+
+字幕在解析完成後即於預取階段下載 (與傳輸同時進行，批次中各任務並行)，
+最終封裝時再一次嵌入，不需 yt-dlp 在下載流程中逐一抓取。
+"""
+import os
+import re
+import threading
+import urllib.request
+from typing import Dict, List, Optional
+
+from utils.config import SUBTITLE_CACHE_DIR, SUBTITLE_CACHE_MAX_BYTES, SUBTITLE_LANGS, SUBTITLE_AUTO
+
+
+# 偏好的字幕格式 (皆可由 ffmpeg 轉為 mov_text)
+PREFERRED_FORMATS = ('vtt', 'srt')
+
+
+def match_languages(available: List[str], wanted: List[str]) -> List[str]:
+    """依偏好順序挑選可用語言 (zh 可匹配 zh-Hant 等子標籤)"""
+    selected = []
+    for lang in wanted:
+        for candidate in available:
+            if candidate in selected:
+                continue
+            if candidate == lang or candidate.startswith(lang + '-'):
+                selected.append(candidate)
+                break
+    return selected
+
+
+def select_track(tracks: List[dict]) -> Optional[dict]:
+    """挑選偏好格式的字幕軌"""
+    for ext in PREFERRED_FORMATS:
+        for track in tracks:
+            if track.get('ext') == ext and track.get('url'):
+                return track
+    return None
+
+
+class SubtitleCache:
+    """字幕 LRU 磁碟快取 (以影片 ID 與語言為鍵)"""
+
+    def __init__(self, cache_dir: str = SUBTITLE_CACHE_DIR, max_bytes: int = SUBTITLE_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path_for(self, video_id: str, lang: str, ext: str) -> str:
+        safe = re.sub(r'[^A-Za-z0-9_.-]', '_', f"{video_id}.{lang}")
+        return os.path.join(self.cache_dir, f"{safe}.{ext}")
+
+    def fetch(self, video_id: str, lang: str, track: dict, timeout: float = 15.0) -> str:
+        """取得字幕檔路徑 (命中時更新存取時間)，未命中時下載"""
+        path = self._path_for(video_id, lang, track['ext'])
+        if os.path.isfile(path):
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+            return path
+        request = urllib.request.Request(track['url'], headers={'User-Agent': 'Mozilla/5.0'})
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            data = response.read()
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._evict()
+        return path
+
+    def _evict(self):
+        """淘汰最久未使用的字幕檔直到總大小低於上限"""
+        with self._lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith(tuple(f".{ext}" for ext in PREFERRED_FORMATS)):
+                    continue
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+    def fetch_for(self, info: dict, langs: List[str] = SUBTITLE_LANGS) -> Dict[str, str]:
+        """下載影片所需語言的字幕，回傳 {語言: 檔案路徑}"""
+        video_id = info.get('id')
+        if not video_id:
+            return {}
+        sources = dict(info.get('subtitles') or {})
+        if SUBTITLE_AUTO:
+            for lang, tracks in (info.get('automatic_captions') or {}).items():
+                sources.setdefault(lang, tracks)
+
+        result = {}
+        for lang in match_languages(list(sources), langs):
+            track = select_track(sources[lang])
+            if not track:
+                continue
+            try:
+                result[lang] = self.fetch(video_id, lang, track)
+            except OSError:
+                continue
+        return result
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+縮圖快取模組 - 以檔案修改時間實作大小上限的 LRU 磁碟快取
+
+寫入快取前以 ffmpeg 將縮圖縮小至 THUMBNAIL_WIDTH 並轉為 JPEG；找不到 ffmpeg
+或轉換失敗時保存原始檔案，副檔名依檔頭判斷 (webp 不會被標成 .jpg)。
+"""
+import os
+import re
+import subprocess
+import threading
+import urllib.request
+from typing import Optional
+
+from utils.config import THUMBNAIL_CACHE_DIR, THUMBNAIL_CACHE_MAX_BYTES, THUMBNAIL_WIDTH
+
+
+# 快取檔案可能的副檔名
+CACHE_EXTENSIONS = ('jpg', 'png', 'webp', 'gif', 'img')
+
+
+def image_extension(data: bytes) -> str:
+    """依檔頭判斷影像格式的副檔名 (無法辨識時為 img)"""
+    if data[:3] == b'\xff\xd8\xff':
+        return 'jpg'
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'png'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    if data[:4] == b'GIF8':
+        return 'gif'
+    return 'img'
+
+
+def downscale(data: bytes, width: int = THUMBNAIL_WIDTH, timeout: float = 15.0) -> Optional[bytes]:
+    """以 ffmpeg 將影像縮小至指定寬度 (不放大) 並轉為 JPEG，失敗時回傳 None"""
+    from downloader import get_ffmpeg_path
+
+    ffmpeg = get_ffmpeg_path()
+    if not ffmpeg or not data:
+        return None
+    try:
+        result = subprocess.run(
+            [
+                ffmpeg, '-v', 'error', '-i', 'pipe:0', '-frames:v', '1',
+                '-vf', f"scale='min({int(width)},iw)':-2", '-q:v', '4',
+                '-f', 'image2pipe', '-c:v', 'mjpeg', 'pipe:1',
+            ],
+            input=data, capture_output=True, timeout=timeout
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if result.returncode != 0 or image_extension(result.stdout) != 'jpg':
+        return None
+    return result.stdout
+
+
+def select_thumbnail(info: dict, min_width: int = THUMBNAIL_WIDTH) -> str:
+    """從 info['thumbnails'] 中挑選寬度足夠的最小縮圖 (優先 jpg)"""
+    thumbnails = [t for t in info.get('thumbnails') or [] if t.get('url')]
+    if not thumbnails:
+        return info.get('thumbnail', '')
+
+    # webp 需要額外的 Qt 影像外掛，盡量避開
+    jpgs = [t for t in thumbnails if '.jpg' in t['url']]
+    candidates = jpgs or thumbnails
+
+    sized = [t for t in candidates if t.get('width')]
+    large_enough = [t for t in sized if t['width'] >= min_width]
+    if large_enough:
+        return min(large_enough, key=lambda t: t['width'])['url']
+    if sized:
+        return max(sized, key=lambda t: t['width'])['url']
+    return info.get('thumbnail') or candidates[-1]['url']
+
+
+class ThumbnailCache:
+    """縮圖 LRU 磁碟快取"""
+
+    def __init__(
+        self,
+        cache_dir: str = THUMBNAIL_CACHE_DIR,
+        max_bytes: int = THUMBNAIL_CACHE_MAX_BYTES,
+        width: int = THUMBNAIL_WIDTH
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.width = width
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path_for(self, key: str, ext: str) -> str:
+        """快取鍵對應的檔案路徑"""
+        safe_key = re.sub(r'[^A-Za-z0-9_-]', '_', key)
+        return os.path.join(self.cache_dir, f"{safe_key}.{ext}")
+
+    def get(self, key: str) -> Optional[str]:
+        """取得快取檔案路徑，並更新存取時間"""
+        for ext in CACHE_EXTENSIONS:
+            path = self._path_for(key, ext)
+            if os.path.isfile(path):
+                break
+        else:
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return path
+
+    def put(self, key: str, data: bytes) -> str:
+        """縮小後寫入快取，超過容量時淘汰最久未使用的檔案"""
+        jpeg = downscale(data, self.width)
+        if jpeg is not None:
+            data, ext = jpeg, 'jpg'
+        else:
+            ext = image_extension(data)
+        path = self._path_for(key, ext)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        # 同一鍵先前以其他格式保存的檔案
+        for other in CACHE_EXTENSIONS:
+            if other != ext:
+                try:
+                    os.remove(self._path_for(key, other))
+                except OSError:
+                    pass
+        self._evict()
+        return path
+
+    def fetch(self, key: str, url: str, timeout: float = 10.0) -> Optional[str]:
+        """取得縮圖，未命中時下載並寫入快取"""
+        path = self.get(key)
+        if path:
+            return path
+        if not url:
+            return None
+        request = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            data = response.read()
+        return self.put(key, data)
+
+    def _evict(self):
+        """淘汰最舊的檔案直到總大小低於上限"""
+        with self._lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.cache_dir):
+                if name.rpartition('.')[2] not in CACHE_EXTENSIONS:
+                    continue
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+CPU 轉檔設定 - x264 速度預設、執行緒分配與同時轉檔數限制
+
+多個 ffmpeg 同時以預設執行緒數轉檔時會互搶 CPU，總吞吐量反而下降。
+這裡以行程共用的 Semaphore 限制同時轉檔數，並把 CPU 核心平均分給每個
+轉檔任務 (明確指定 -threads)。
+
+以 `python -m engine.transcode 影片檔` 可比較不同設定的總吞吐量。
+"""
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import List, Optional
+
+from utils.config import TRANSCODE_PROFILES, MAX_CONCURRENT_TRANSCODES
+
+
+_transcode_slots = threading.BoundedSemaphore(MAX_CONCURRENT_TRANSCODES)
+
+
+def cpu_share(concurrency: int = MAX_CONCURRENT_TRANSCODES) -> int:
+    """每個轉檔任務分配到的執行緒數"""
+    return max(1, (os.cpu_count() or 1) // max(1, concurrency))
+
+
+def needs_transcode(info: dict) -> bool:
+    """來源視訊不是 H.264 時才需要轉檔"""
+    vcodec = (info.get('vcodec') or '').lower()
+    if vcodec in ('', 'none'):
+        return False
+    return not (vcodec.startswith('avc') or vcodec.startswith('h264'))
+
+
+def video_args(profile: dict, threads: Optional[int] = None) -> List[str]:
+    """產生 x264 轉檔參數"""
+    threads = threads or cpu_share()
+    return [
+        '-c:v', 'libx264',
+        '-preset', profile['preset'],
+        '-crf', str(profile['crf']),
+        '-pix_fmt', 'yuv420p',
+        '-threads', str(threads),
+    ]
+
+
+@contextmanager
+def transcode_slot():
+    """取得轉檔名額 (超過同時轉檔數時等待)"""
+    with _transcode_slots:
+        yield
+
+
+def _encode(ffmpeg: str, source: str, profile: dict, threads: int, seconds: int) -> float:
+    """轉檔 seconds 秒的影片到 null 輸出，回傳耗時"""
+    start = time.perf_counter()
+    subprocess.run(
+        [ffmpeg, '-v', 'error', '-y', '-t', str(seconds), '-i', source, '-an']
+        + video_args(profile, threads) + ['-f', 'null', '-'],
+        check=True
+    )
+    return time.perf_counter() - start
+
+
+def benchmark(source: str, jobs: int = 4, seconds: int = 30) -> List[dict]:
+    """以 jobs 個同時轉檔比較各設定與執行緒分配的總吞吐量 (每秒處理的影片秒數)"""
+    from downloader import get_ffmpeg_path
+
+    ffmpeg = get_ffmpeg_path()
+    cpus = os.cpu_count() or 1
+    results = []
+    for name, profile in TRANSCODE_PROFILES.items():
+        if not profile:
+            continue
+        for concurrency in sorted({1, max(1, jobs // 2), jobs}):
+            threads = max(1, cpus // concurrency)
+            start = time.perf_counter()
+            # 同一時間最多 concurrency 個轉檔，共處理 jobs 個
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(
+                    lambda _: _encode(ffmpeg, source, profile, threads, seconds), range(jobs)
+                ))
+            elapsed = time.perf_counter() - start
+            results.append({
+                'profile': name,
+                'concurrency': concurrency,
+                'threads': threads,
+                'elapsed': elapsed,
+                'throughput': jobs * seconds / elapsed,
+            })
+    return results
+
+
+if __name__ == '__main__':
+    import sys
+
+    for row in benchmark(sys.argv[1]):
+        print(f"{row['profile']:<10} 同時 {row['concurrency']} 個 × {row['threads']:>2} 執行緒: "
+              f"{row['elapsed']:6.1f} 秒, 吞吐量 {row['throughput']:.2f}x")
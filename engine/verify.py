@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+下載完整性驗證 - 於後處理階段檢查輸出檔案
+
+檢查項目：
+- 檔案大小不低於預期大小 (資訊中有 filesize 且未重新編碼時)
+- ffprobe 讀得到預期的音視訊串流，且長度與資訊相符、音視訊長度一致
+- (選用) 計算 SHA-256 並寫入旁邊的 .sha256 檔案
+
+驗證失敗的檔案會被刪除，並記錄在 job.redownload_ranges 供引擎只重新下載
+出問題的部分 (片段下載時僅重抓失敗的片段)。
+"""
+import hashlib
+import json
+import os
+import subprocess
+from typing import List, Optional
+
+from downloader import get_ffprobe_path
+from engine.stream_store import StreamStore
+from utils.config import (
+    VERIFY_SIZE_TOLERANCE, VERIFY_DURATION_TOLERANCE, VERIFY_CHECKSUM, STREAM_STORE
+)
+
+
+def probe(path: str) -> Optional[dict]:
+    """以 ffprobe 讀取容器與串流資訊，ffprobe 不存在時回傳 None"""
+    ffprobe = get_ffprobe_path()
+    if not ffprobe:
+        return None
+    result = subprocess.run(
+        [ffprobe, '-v', 'error', '-show_entries',
+         'format=duration:stream=codec_type,duration', '-of', 'json', path],
+        capture_output=True, text=True, timeout=60
+    )
+    if result.returncode != 0:
+        raise ValueError(result.stderr.strip() or "ffprobe 無法讀取檔案")
+    return json.loads(result.stdout or '{}')
+
+
+def check_file(path: str, expected: dict) -> Optional[str]:
+    """驗證單一輸出檔案，通過時回傳 None，否則回傳失敗原因"""
+    if not path or not os.path.isfile(path):
+        return "找不到輸出檔案"
+    size = os.path.getsize(path)
+    if size == 0:
+        return "檔案大小為 0"
+
+    is_section = 'section_start' in expected
+    expected_size = expected.get('filesize')
+    if (expected_size and not is_section and not expected.get('reencoded')
+            and size < expected_size * VERIFY_SIZE_TOLERANCE):
+        return f"檔案大小不足 ({size} / {expected_size} bytes)"
+
+    try:
+        data = probe(path)
+    except (ValueError, OSError, subprocess.TimeoutExpired) as e:
+        return f"ffprobe 失敗: {e}"
+    if data is None:
+        return None
+
+    streams = data.get('streams') or []
+    types = {s.get('codec_type') for s in streams}
+    if expected.get('vcodec') not in (None, 'none') and 'video' not in types:
+        return "缺少視訊串流"
+    if expected.get('acodec') not in (None, 'none') and 'audio' not in types:
+        return "缺少音訊串流"
+
+    if is_section:
+        expected_duration = expected['section_end'] - expected['section_start']
+    else:
+        expected_duration = expected.get('duration')
+    duration = float((data.get('format') or {}).get('duration') or 0)
+    if expected_duration and duration:
+        tolerance = max(2.0, expected_duration * VERIFY_DURATION_TOLERANCE)
+        if abs(duration - expected_duration) > tolerance:
+            return f"影片長度不符 ({duration:.1f} / {expected_duration:.1f} 秒)"
+
+    # 音視訊各自的長度差距過大代表不同步或有一軌被截斷
+    durations = {
+        s.get('codec_type'): float(s['duration'])
+        for s in streams if s.get('duration') not in (None, 'N/A')
+    }
+    if 'video' in durations and 'audio' in durations:
+        if abs(durations['video'] - durations['audio']) > max(1.0, duration * VERIFY_DURATION_TOLERANCE):
+            return f"音視訊長度不一致 ({durations['video']:.1f} / {durations['audio']:.1f} 秒)"
+
+    return None
+
+
+def write_checksum(path: str) -> str:
+    """計算 SHA-256 並寫入 <檔名>.sha256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    checksum = digest.hexdigest()
+    with open(path + '.sha256', 'w', encoding='utf-8') as f:
+        f.write(f"{checksum}  {os.path.basename(path)}\n")
+    return checksum
+
+
+class DownloadVerifier:
+    """下載引擎的驗證後處理"""
+
+    def __init__(self, engine, checksum: bool = VERIFY_CHECKSUM):
+        self.engine = engine
+        self.checksum = checksum
+        # 驗證失敗的串流也要從存放區移除，避免重新下載時再次取用
+        self.stream_store = StreamStore() if STREAM_STORE else None
+
+    def __call__(self, job) -> bool:
+        if not job.verify or not job.info:
+            return True
+
+        self.engine.emit('status', job.url, {'message': "正在驗證檔案..."})
+        downloads = job.info.get('requested_downloads') or [job.info]
+        failures: List[dict] = []
+        reasons = []
+        for download in downloads:
+            path = download.get('filepath') or download.get('_filename')
+            expected = dict(job.info, **download)
+            reason = check_file(path, expected)
+            if reason:
+                failures.append(expected)
+                reasons.append(reason)
+                if path and os.path.isfile(path):
+                    os.remove(path)
+                if self.stream_store:
+                    self.stream_store.discard(expected)
+            elif self.checksum:
+                write_checksum(path)
+
+        if not failures:
+            self.engine.emit('status', job.url, {'message': "驗證通過"})
+            return True
+
+        # 片段下載時只重新下載失敗的片段，否則重新下載整個檔案
+        job.redownload_ranges = [
+            (f['section_start'], f['section_end']) for f in failures if 'section_start' in f
+        ]
+        self.engine.emit('status', job.url, {'message': f"驗證失敗: {reasons[0]}"})
+        return False
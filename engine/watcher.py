@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+訂閱監看模組 - 定期輪詢頻道 / 播放清單，只下載新上架的影片
+
+每個監看項目保存最近看過的影片 ID。輪詢時以 lazy 分頁逐筆讀取清單並
+逐一比對：頻道清單為最新在前，連續 WATCH_SEEN_STREAK 筆都已看過即停止翻頁；
+播放清單可能依加入順序或手動排序，最多讀取 WATCH_SEEN_IDS 筆。
+頻道若提供 RSS feed，會先以 ETag / Last-Modified 發出條件式請求，
+未變更 (304) 時完全略過清單解析；新的 ETag / Last-Modified 只在清單
+處理成功後才保存，失敗的輪詢不會讓下次被 304 略過。
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List, Optional, Tuple
+
+import yt_dlp
+
+from engine.async_engine import DownloadEngine, DownloadJob, STAGE_EXTRACT
+from engine.session import session_manager
+from utils.config import (
+    WATCHLIST_PATH, WATCH_POLL_INTERVAL, WATCH_SEEN_IDS, WATCH_SEEN_STREAK, DEFAULT_DOWNLOAD_PATH,
+    DEFAULT_OWNER
+)
+
+# YouTube 頻道 RSS feed
+FEED_URL_TEMPLATE = "https://www.youtube.com/feeds/videos.xml?channel_id={}"
+
+
+class WatchEntry:
+    """單個監看項目"""
+
+    def __init__(
+        self,
+        url: str,
+        output_path: str = DEFAULT_DOWNLOAD_PATH,
+        quality: str = "最高畫質",
+        seen_ids: Optional[List[str]] = None,
+        feed_url: str = "",
+        etag: str = "",
+        last_modified: str = "",
+        last_checked: float = 0.0,
+        owner: str = DEFAULT_OWNER
+    ):
+        self.url = url
+        self.output_path = output_path
+        self.quality = quality
+        # 依最近一次清單順序，最多保留 WATCH_SEEN_IDS 筆
+        self.seen_ids = seen_ids or []
+        self.feed_url = feed_url
+        self.etag = etag
+        self.last_modified = last_modified
+        self.last_checked = last_checked
+        self.owner = owner
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'WatchEntry':
+        return cls(**data)
+
+
+class WatchList:
+    """監看清單 (JSON 檔案保存)"""
+
+    def __init__(self, path: str = WATCHLIST_PATH):
+        self.path = path
+        self.entries: Dict[str, WatchEntry] = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """讀取監看清單"""
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.entries = {item['url']: WatchEntry.from_dict(item) for item in data}
+
+    def save(self):
+        """寫入監看清單"""
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump([e.to_dict() for e in self.entries.values()], f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+
+    def add(
+        self, url: str, output_path: str = DEFAULT_DOWNLOAD_PATH, quality: str = "最高畫質",
+        owner: str = DEFAULT_OWNER
+    ) -> WatchEntry:
+        """新增監看項目"""
+        entry = self.entries.get(url)
+        if entry is None:
+            entry = WatchEntry(url, output_path, quality, owner=owner)
+            self.entries[url] = entry
+            self.save()
+        return entry
+
+    def remove(self, url: str):
+        """移除監看項目"""
+        if self.entries.pop(url, None):
+            self.save()
+
+
+class ChannelWatcher:
+    """定期輪詢監看清單並將新影片交給下載引擎"""
+
+    def __init__(self, engine: DownloadEngine, watchlist: WatchList, interval: float = WATCH_POLL_INTERVAL):
+        self.engine = engine
+        self.watchlist = watchlist
+        self.interval = interval
+        self._task = None
+
+    def start(self):
+        """在引擎的事件迴圈中開始定期輪詢"""
+        if self._task is None:
+            self._task = self.engine.run_coroutine(self._poll_forever())
+
+    def stop(self):
+        """停止輪詢"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _poll_forever(self):
+        """輪詢主迴圈"""
+        while True:
+            await self.poll_all()
+            await asyncio.sleep(self.interval)
+
+    async def poll_all(self) -> int:
+        """輪詢所有到期的監看項目，回傳排入下載的影片數"""
+        now = time.time()
+        due = [e for e in self.watchlist.entries.values() if now - e.last_checked >= self.interval]
+        results = await asyncio.gather(
+            *(self.engine.run_stage(STAGE_EXTRACT, self.poll_entry, entry) for entry in due),
+            return_exceptions=True
+        )
+        queued = 0
+        for entry, result in zip(due, results):
+            if isinstance(result, Exception):
+                self.engine.emit('status', entry.url, {'message': f"監看輪詢失敗: {result}"})
+                continue
+            for video_url in result:
+                if self.engine.jobs_for(video_url):
+                    continue
+                self.engine.submit(DownloadJob(
+                    video_url, entry.output_path, entry.quality, owner=entry.owner
+                ))
+                queued += 1
+        if due:
+            self.watchlist.save()
+        return queued
+
+    def _feed_unchanged(self, entry: WatchEntry) -> Tuple[bool, Optional[Tuple[str, str]]]:
+        """以條件式請求檢查 RSS feed 是否變更
+
+        回傳 (未變更, 新的 (ETag, Last-Modified))；驗證資訊由呼叫端在清單處理成功後才保存
+        """
+        if not entry.feed_url:
+            return False, None
+        headers = {'User-Agent': 'Mozilla/5.0'}
+        if entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+        request = urllib.request.Request(entry.feed_url, headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=15) as response:
+                return False, (response.headers.get('ETag', ''), response.headers.get('Last-Modified', ''))
+        except urllib.error.HTTPError as e:
+            return e.code == 304, None
+        except OSError:
+            return False, None
+
+    def poll_entry(self, entry: WatchEntry) -> List[str]:
+        """輪詢單個監看項目 (阻塞)，回傳新影片的連結"""
+        entry.last_checked = time.time()
+        validators = None
+        if entry.seen_ids:
+            unchanged, validators = self._feed_unchanged(entry)
+            if unchanged:
+                return []
+
+        ydl_opts = {
+            'quiet': True,
+            'no_warnings': True,
+            'extract_flat': 'in_playlist',
+            'lazy_playlist': True,
+        }
+        listed = []
+        session_manager.acquire(entry.url)
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            session_manager.attach(ydl)
+            try:
+                result = ydl.extract_info(entry.url, download=False, process=False)
+            except Exception as e:
+                session_manager.report(entry.url, e)
+                raise
+            finally:
+                session_manager.save_cookies()
+            session_manager.report(entry.url)
+            if not entry.feed_url and result.get('channel_id'):
+                entry.feed_url = FEED_URL_TEMPLATE.format(result['channel_id'])
+
+            # 頻道清單 (ID 即頻道 ID) 為最新在前，可在連續遇到已看過的影片時提早停止
+            newest_first = bool(result.get('channel_id')) and result.get('id') == result.get('channel_id')
+            seen = set(entry.seen_ids)
+            streak = 0
+            # 逐一比對清單中的每個 ID；只讀取記錄範圍內的筆數，超過的無從比對
+            for item in result.get('entries') or []:
+                if not item or not item.get('id'):
+                    continue
+                listed.append(item)
+                streak = streak + 1 if item['id'] in seen else 0
+                if len(listed) >= WATCH_SEEN_IDS or (newest_first and streak >= WATCH_SEEN_STREAK):
+                    break
+
+        if validators:
+            entry.etag, entry.last_modified = validators
+        first_poll = not seen
+        new_entries = [item for item in listed if item['id'] not in seen]
+        listed_ids = [item['id'] for item in listed]
+        kept = set(listed_ids)
+        entry.seen_ids = (listed_ids + [i for i in entry.seen_ids if i not in kept])[:WATCH_SEEN_IDS]
+        # 首次輪詢只建立基準，不下載既有影片
+        if first_poll:
+            return []
+
+        # 依清單中的相反順序排入下載 (頻道清單最新在前，即依上架順序)
+        return [
+            item.get('url') or f"https://www.youtube.com/watch?v={item['id']}"
+            for item in reversed(new_entries)
+        ]
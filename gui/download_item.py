@@ -7,7 +7,7 @@ from PyQt6.QtWidgets import (
     QPushButton, QFrame
 )
 from PyQt6.QtCore import Qt, pyqtSignal
-from PyQt6.QtGui import QFont
+from PyQt6.QtGui import QFont, QPixmap
 
 
 class DownloadItemWidget(QFrame):
@@ -56,6 +56,13 @@ class DownloadItemWidget(QFrame):
         main_layout.setSpacing(15)
         main_layout.setContentsMargins(10, 8, 10, 8)
         
+        # 最左側：縮圖 (預取完成後顯示)
+        self.thumbnail_label = QLabel()
+        self.thumbnail_label.setFixedSize(96, 54)
+        self.thumbnail_label.setStyleSheet("background-color: #1a1a1a; border-radius: 4px;")
+        self.thumbnail_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        main_layout.addWidget(self.thumbnail_label)
+        
         # 左側：標題和狀態
         left_layout = QVBoxLayout()
         left_layout.setSpacing(4)
@@ -66,6 +73,11 @@ class DownloadItemWidget(QFrame):
         self.title_label.setMaximumWidth(500)
         left_layout.addWidget(self.title_label)
         
+        self.meta_label = QLabel()
+        self.meta_label.setStyleSheet("color: #aaaaaa; font-size: 10px;")
+        self.meta_label.hide()
+        left_layout.addWidget(self.meta_label)
+        
         self.status_label = QLabel("等待中...")
         self.status_label.setStyleSheet("color: #888888; font-size: 11px;")
         left_layout.addWidget(self.status_label)
@@ -99,6 +111,29 @@ class DownloadItemWidget(QFrame):
             title = title[:57] + "..."
         self.title_label.setText(title)
         
+    def update_metadata(self, data: dict):
+        """更新上傳者、長度與縮圖"""
+        uploader = data.get('uploader')
+        duration = data.get('duration')
+        if uploader or duration:
+            parts = []
+            if uploader:
+                parts.append(uploader)
+            if duration:
+                parts.append(self._format_time(int(duration)))
+            self.meta_label.setText(" | ".join(parts))
+            self.meta_label.show()
+            
+        thumbnail_path = data.get('thumbnail_path')
+        if thumbnail_path:
+            pixmap = QPixmap(thumbnail_path)
+            if not pixmap.isNull():
+                self.thumbnail_label.setPixmap(pixmap.scaled(
+                    self.thumbnail_label.size(),
+                    Qt.AspectRatioMode.KeepAspectRatio,
+                    Qt.TransformationMode.SmoothTransformation
+                ))
+        
     def update_progress(self, data: dict):
         """更新進度"""
         status = data.get('status', '')
@@ -8,83 +8,80 @@ from PyQt6.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QLabel, QTextEdit, QComboBox, QPushButton,
     QFileDialog, QScrollArea, QFrame, QLineEdit,
-    QMessageBox, QSplitter
+    QMessageBox, QSplitter, QCheckBox, QSpinBox
 )
-from PyQt6.QtCore import Qt, QThreadPool, QRunnable, pyqtSignal, QObject, pyqtSlot
+from PyQt6.QtCore import Qt, pyqtSignal, QObject, pyqtSlot
 from PyQt6.QtGui import QFont, QIcon
 
-from downloader import VideoDownloader, check_dependencies
-from utils.config import QUALITY_OPTIONS, DEFAULT_DOWNLOAD_PATH, MAX_CONCURRENT_DOWNLOADS
+from downloader import check_dependencies, parse_sections
+from engine.async_engine import (
+    DownloadEngine, DownloadJob, STAGE_EXTRACT, STAGE_TRANSFER, STAGE_POSTPROCESS
+)
+from engine.autotune import AutoTuner
+from engine.events import start_event_stream
+from engine.profiling import profiler
+from engine.subtitles import SubtitleCache
+from engine.thumbnail_cache import ThumbnailCache
+from utils.config import (
+    QUALITY_OPTIONS, DEFAULT_DOWNLOAD_PATH, EVENT_STREAM_PORT, MAX_POOL_SIZE, AUTOTUNE,
+    VERIFY_DOWNLOADS, EMBED_SUBTITLES, TRANSCODE_PROFILES, DEFAULT_TRANSCODE_PROFILE, DEFAULT_OWNER
+)
 from gui.download_item import DownloadItemWidget
 
 
-class WorkerSignals(QObject):
-    """工作執行緒信號"""
+class EngineSignals(QObject):
+    """下載引擎信號轉接器 - 將引擎事件轉為 Qt 信號 (跨執行緒安全)"""
     progress = pyqtSignal(str, dict)  # url, progress_data
     status = pyqtSignal(str, str)     # url, status_message
     finished = pyqtSignal(str, bool)  # url, success
     title_fetched = pyqtSignal(str, str)  # url, title
-
-
-class DownloadWorker(QRunnable):
-    """下載工作執行緒"""
+    metadata_fetched = pyqtSignal(str, dict)  # url, metadata
+    limits_changed = pyqtSignal(dict)  # stage -> limit
     
-    def __init__(self, url: str, output_path: str, quality: str, use_aria2c: bool = True):
-        super().__init__()
-        self.url = url
-        self.output_path = output_path
-        self.quality = quality
-        self.use_aria2c = use_aria2c
-        self.signals = WorkerSignals()
-        self.downloader = None
-        
-    def run(self):
-        """執行下載"""
-        def progress_callback(data):
-            self.signals.progress.emit(self.url, data)
-            
-        def status_callback(message):
-            self.signals.status.emit(self.url, message)
-            
-        self.downloader = VideoDownloader(
-            url=self.url,
-            output_path=self.output_path,
-            quality=self.quality,
-            progress_callback=progress_callback,
-            status_callback=status_callback,
-            use_aria2c=self.use_aria2c
-        )
-        
-        # 先獲取標題
-        try:
-            info = self.downloader.get_video_info()
-            self.signals.title_fetched.emit(self.url, info['title'])
-        except Exception as e:
-            self.signals.title_fetched.emit(self.url, f"未知標題 ({self.url[:30]}...)")
-        
-        # 執行下載
-        success = self.downloader.download()
-        self.signals.finished.emit(self.url, success)
-        
-    def cancel(self):
-        """取消下載"""
-        if self.downloader:
-            self.downloader.cancel()
+    def dispatch(self, kind: str, url: str, data: dict):
+        """引擎事件回調 (於引擎執行緒中呼叫)"""
+        if kind == 'progress':
+            self.progress.emit(url, data)
+        elif kind == 'status':
+            self.status.emit(url, data.get('message', ''))
+        elif kind == 'title':
+            self.title_fetched.emit(url, data.get('title', ''))
+        elif kind == 'metadata':
+            self.metadata_fetched.emit(url, data)
+        elif kind == 'finished':
+            self.finished.emit(url, data.get('success', False))
+        elif kind == 'limits':
+            self.limits_changed.emit(data)
 
 
 class MainWindow(QMainWindow):
     """主視窗"""
     
-    def __init__(self):
+    def __init__(self, event_port: int = EVENT_STREAM_PORT, autotune: bool = AUTOTUNE):
         super().__init__()
-        self.thread_pool = QThreadPool()
-        self.thread_pool.setMaxThreadCount(MAX_CONCURRENT_DOWNLOADS)
+        self.engine_signals = EngineSignals()
+        self.engine_signals.progress.connect(self._on_progress)
+        self.engine_signals.status.connect(self._on_status)
+        self.engine_signals.finished.connect(self._on_finished)
+        self.engine_signals.title_fetched.connect(self._on_title_fetched)
+        self.engine_signals.metadata_fetched.connect(self._on_metadata_fetched)
+        self.engine_signals.limits_changed.connect(self._on_limits_changed)
+        self.engine = DownloadEngine(
+            listener=self.engine_signals.dispatch,
+            thumbnail_cache=ThumbnailCache(),
+            subtitle_cache=SubtitleCache()
+        )
+        self.event_stream = start_event_stream(
+            self.engine.event_bus, port=event_port, control=self.engine
+        )
+        self.autotuner = AutoTuner(self.engine)
         self.download_items: Dict[str, DownloadItemWidget] = {}
-        self.download_workers: Dict[str, DownloadWorker] = {}
+        self.download_jobs: Dict[str, DownloadJob] = {}
         self.output_path = DEFAULT_DOWNLOAD_PATH
         
         self._setup_ui()
         self._check_dependencies()
+        self.autotune_check.setChecked(autotune)
         
     def _setup_ui(self):
         """設置 UI"""
@@ -199,7 +196,7 @@ class MainWindow(QMainWindow):
         """)
         url_layout = QVBoxLayout(url_frame)
         
-        url_label = QLabel("📋 貼上 YouTube 連結 (每行一個):")
+        url_label = QLabel("📋 貼上 YouTube 連結 (每行一個，可在連結後加上片段):")
         url_label.setFont(QFont("Microsoft JhengHei", 12))
         url_layout.addWidget(url_label)
         
@@ -207,7 +204,8 @@ class MainWindow(QMainWindow):
         self.url_input.setPlaceholderText(
             "範例:\n"
             "https://www.youtube.com/watch?v=xxxxx\n"
-            "https://youtu.be/xxxxx\n"
+            "https://youtu.be/xxxxx 1:00-2:30, 5:00-6:00\n"
+            "https://youtu.be/xxxxx Intro, 10:00-inf\n"
             "https://www.youtube.com/playlist?list=xxxxx"
         )
         self.url_input.setMinimumHeight(120)
@@ -232,6 +230,32 @@ class MainWindow(QMainWindow):
         quality_layout.addWidget(self.quality_combo)
         settings_layout.addLayout(quality_layout)
         
+        # 轉檔設定 (來源非 H.264 時以 CPU 轉檔)
+        transcode_layout = QHBoxLayout()
+        transcode_label = QLabel("🎞️ 轉檔:")
+        transcode_label.setFont(QFont("Microsoft JhengHei", 12))
+        transcode_layout.addWidget(transcode_label)
+        
+        self.transcode_combo = QComboBox()
+        self.transcode_combo.addItems(list(TRANSCODE_PROFILES.keys()))
+        self.transcode_combo.setCurrentText(DEFAULT_TRANSCODE_PROFILE)
+        self.transcode_combo.setToolTip("來源為 VP9 / AV1 時轉為 H.264，速度越快檔案越大")
+        transcode_layout.addWidget(self.transcode_combo)
+        settings_layout.addLayout(transcode_layout)
+        
+        # 擁有者 (用量統計與配額)
+        owner_layout = QHBoxLayout()
+        owner_label = QLabel("👤 擁有者:")
+        owner_label.setFont(QFont("Microsoft JhengHei", 12))
+        owner_layout.addWidget(owner_label)
+        
+        self.owner_input = QLineEdit()
+        self.owner_input.setText(DEFAULT_OWNER)
+        self.owner_input.setMaximumWidth(120)
+        self.owner_input.setToolTip("使用者或團隊名稱，用於用量統計、配額與同時下載上限")
+        owner_layout.addWidget(self.owner_input)
+        settings_layout.addLayout(owner_layout)
+        
         settings_layout.addStretch()
         
         # 輸出資料夾
@@ -272,6 +296,31 @@ class MainWindow(QMainWindow):
         aria2c_layout.addWidget(self.aria2c_status)
         aria2c_layout.addStretch()
         
+        # 片段精確切割選項
+        self.precise_cuts_check = QCheckBox("✂️ 片段精確切割 (切點重新編碼)")
+        self.precise_cuts_check.setStyleSheet("color: #eaeaea; font-size: 12px;")
+        aria2c_layout.addWidget(self.precise_cuts_check)
+        
+        # 直播從頭錄製
+        self.long_mode_check = QCheckBox("📡 直播從頭錄製")
+        self.long_mode_check.setStyleSheet("color: #eaeaea; font-size: 12px;")
+        self.long_mode_check.setToolTip("從直播開頭錄製，片段邊下載邊寫入磁碟，記憶體用量不隨長度增加")
+        aria2c_layout.addWidget(self.long_mode_check)
+        
+        # 下載後完整性驗證
+        self.verify_check = QCheckBox("🔍 下載後驗證")
+        self.verify_check.setStyleSheet("color: #eaeaea; font-size: 12px;")
+        self.verify_check.setToolTip("檢查檔案大小、長度與音視訊串流，失敗時自動重新下載")
+        self.verify_check.setChecked(VERIFY_DOWNLOADS)
+        aria2c_layout.addWidget(self.verify_check)
+        
+        # 字幕 / 章節 / 標籤嵌入
+        self.embed_check = QCheckBox("📝 嵌入字幕與章節")
+        self.embed_check.setStyleSheet("color: #eaeaea; font-size: 12px;")
+        self.embed_check.setToolTip("在最終封裝時一次嵌入字幕、章節與影片標籤")
+        self.embed_check.setChecked(EMBED_SUBTITLES)
+        aria2c_layout.addWidget(self.embed_check)
+        
         main_layout.addLayout(aria2c_layout)
         
         # 下載按鈕
@@ -353,9 +402,28 @@ class MainWindow(QMainWindow):
         
         status_layout.addStretch()
         
-        concurrent_label = QLabel(f"最大同時下載: {MAX_CONCURRENT_DOWNLOADS} 個")
-        concurrent_label.setStyleSheet("color: #888888; font-size: 11px;")
-        status_layout.addWidget(concurrent_label)
+        # 各階段同時數量 (執行中可調整，不影響進行中的任務)
+        self.limit_spins: Dict[str, QSpinBox] = {}
+        limits = self.engine.limits()
+        for stage, text in (
+            (STAGE_TRANSFER, "同時下載"), (STAGE_EXTRACT, "解析"), (STAGE_POSTPROCESS, "後處理")
+        ):
+            label = QLabel(f"{text}:")
+            label.setStyleSheet("color: #888888; font-size: 11px;")
+            status_layout.addWidget(label)
+            
+            spin = QSpinBox()
+            spin.setRange(1, MAX_POOL_SIZE)
+            spin.setValue(limits[stage])
+            spin.valueChanged.connect(lambda value, stage=stage: self.engine.set_limit(stage, value))
+            status_layout.addWidget(spin)
+            self.limit_spins[stage] = spin
+        
+        self.autotune_check = QCheckBox("自動調整")
+        self.autotune_check.setStyleSheet("color: #888888; font-size: 11px;")
+        self.autotune_check.setToolTip("依吞吐量、CPU 使用率與錯誤率自動增減各階段同時數量")
+        self.autotune_check.toggled.connect(self._toggle_autotune)
+        status_layout.addWidget(self.autotune_check)
         
         main_layout.addLayout(status_layout)
         
@@ -413,13 +481,20 @@ class MainWindow(QMainWindow):
             QMessageBox.warning(self, "提示", "請輸入至少一個 YouTube 連結")
             return
             
-        urls = [url.strip() for url in text.split('\n') if url.strip()]
+        lines = [line.strip() for line in text.split('\n') if line.strip()]
         
-        # 過濾有效 URL
+        # 過濾有效 URL，並解析連結後方的片段設定
         valid_urls = []
-        for url in urls:
+        sections = {}
+        for line in lines:
+            url, _, spec = line.partition(' ')
             if 'youtube.com' in url or 'youtu.be' in url:
                 if url not in self.download_items:
+                    try:
+                        sections[url] = parse_sections(spec)
+                    except Exception as e:
+                        QMessageBox.warning(self, "提示", f"片段設定錯誤:\n{line}\n\n{e}")
+                        return
                     valid_urls.append(url)
                     
         if not valid_urls:
@@ -431,6 +506,12 @@ class MainWindow(QMainWindow):
         
         # 獲取設定
         quality = self.quality_combo.currentText()
+        precise_cuts = self.precise_cuts_check.isChecked()
+        long_mode = self.long_mode_check.isChecked()
+        verify = self.verify_check.isChecked()
+        embed = self.embed_check.isChecked()
+        transcode = self.transcode_combo.currentText()
+        owner = self.owner_input.text().strip() or DEFAULT_OWNER
         output_path = self.path_input.text() or self.output_path
         
         # 創建下載項目
@@ -441,15 +522,17 @@ class MainWindow(QMainWindow):
             self.download_items[url] = item_widget
             self.download_list_layout.addWidget(item_widget)
             
-            # 創建工作執行緒
-            worker = DownloadWorker(url, output_path, quality, self.aria2c_enabled)
-            worker.signals.progress.connect(self._on_progress)
-            worker.signals.status.connect(self._on_status)
-            worker.signals.finished.connect(self._on_finished)
-            worker.signals.title_fetched.connect(self._on_title_fetched)
-            
-            self.download_workers[url] = worker
-            self.thread_pool.start(worker)
+            # 提交至下載引擎
+            chapters, ranges = sections[url]
+            job = DownloadJob(
+                url, output_path, quality, self.aria2c_enabled,
+                chapters=chapters, ranges=ranges, precise_cuts=precise_cuts,
+                long_mode=long_mode, verify=verify,
+                embed_subtitles=embed, embed_metadata=embed, transcode=transcode,
+                owner=owner
+            )
+            self.download_jobs[url] = job
+            self.engine.submit(job)
             
         self.status_label.setText(f"正在下載 {len(valid_urls)} 個影片...")
         
@@ -457,7 +540,7 @@ class MainWindow(QMainWindow):
         """清除已完成的下載項目"""
         urls_to_remove = []
         for url, item in self.download_items.items():
-            if url not in self.download_workers:
+            if url not in self.download_jobs:
                 urls_to_remove.append(url)
                 
         for url in urls_to_remove:
@@ -471,47 +554,75 @@ class MainWindow(QMainWindow):
     @pyqtSlot(str)
     def _cancel_download(self, url: str):
         """取消下載"""
-        if url in self.download_workers:
-            self.download_workers[url].cancel()
+        if url in self.download_jobs:
+            self.engine.cancel(url)
             if url in self.download_items:
                 self.download_items[url].update_progress({'status': 'cancelled'})
                 
     @pyqtSlot(str, dict)
+    @profiler.traced('qt:progress')
     def _on_progress(self, url: str, data: dict):
         """進度更新處理"""
         if url in self.download_items:
             self.download_items[url].update_progress(data)
             
     @pyqtSlot(str, str)
+    @profiler.traced('qt:status')
     def _on_status(self, url: str, message: str):
         """狀態更新處理"""
         if url in self.download_items:
             self.download_items[url].update_status(message)
             
     @pyqtSlot(str, str)
+    @profiler.traced('qt:title')
     def _on_title_fetched(self, url: str, title: str):
         """標題獲取處理"""
         if url in self.download_items:
             self.download_items[url].update_title(title)
             
+    @pyqtSlot(str, dict)
+    @profiler.traced('qt:metadata')
+    def _on_metadata_fetched(self, url: str, data: dict):
+        """影片資訊 / 縮圖獲取處理"""
+        if url in self.download_items:
+            self.download_items[url].update_metadata(data)
+            
     @pyqtSlot(str, bool)
+    @profiler.traced('qt:finished')
     def _on_finished(self, url: str, success: bool):
         """下載完成處理"""
-        if url in self.download_workers:
-            del self.download_workers[url]
+        if url in self.download_jobs:
+            del self.download_jobs[url]
             
         # 更新狀態
-        active_count = len(self.download_workers)
+        active_count = len(self.download_jobs)
         if active_count > 0:
             self.status_label.setText(f"正在下載 {active_count} 個影片...")
         else:
             self.status_label.setText("所有下載已完成")
             
+    def _toggle_autotune(self, enabled: bool):
+        """開關自動調整"""
+        if enabled:
+            self.autotuner.start()
+        else:
+            self.autotuner.stop()
+            
+    @pyqtSlot(dict)
+    def _on_limits_changed(self, limits: dict):
+        """同時數量變更 (手動或自動調整) 時同步顯示"""
+        for stage, spin in self.limit_spins.items():
+            if stage in limits and spin.value() != limits[stage]:
+                spin.blockSignals(True)
+                spin.setValue(limits[stage])
+                spin.blockSignals(False)
+            
     def closeEvent(self, event):
         """關閉視窗處理"""
+        self.autotuner.stop()
         # 取消所有進行中的下載
-        for worker in self.download_workers.values():
-            worker.cancel()
-        self.thread_pool.waitForDone(3000)
+        self.engine.shutdown(3.0)
+        if self.event_stream:
+            self.event_stream.stop()
         event.accept()
 
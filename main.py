@@ -5,6 +5,8 @@ YouTube 影片下載器
 """
 import sys
 import os
+import time
+import argparse
 
 # 確保當前目錄在路徑中
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -14,34 +16,134 @@ from PyQt6.QtCore import Qt
 from PyQt6.QtGui import QFont
 
 from gui.main_window import MainWindow
+from engine.profiling import profiler, SAMPLERS
+from engine.replay import harness
+from utils.config import (
+    DEFAULT_DOWNLOAD_PATH, QUALITY_OPTIONS, EVENT_STREAM_PORT, AUTOTUNE, DEFAULT_OWNER
+)
+
+
+def parse_args():
+    """解析命令列參數 (未知參數保留給 Qt)"""
+    parser = argparse.ArgumentParser(description="YouTube 影片下載器")
+    parser.add_argument('--watch', action='store_true',
+                        help="無介面模式：定期輪詢監看清單並下載新影片")
+    parser.add_argument('--watch-add', metavar='URL',
+                        help="將頻道 / 播放清單加入監看清單")
+    parser.add_argument('--watch-remove', metavar='URL',
+                        help="從監看清單移除")
+    parser.add_argument('--output', default=DEFAULT_DOWNLOAD_PATH,
+                        help="下載位置 (搭配 --watch-add)")
+    parser.add_argument('--quality', default="最高畫質", choices=list(QUALITY_OPTIONS.keys()),
+                        help="畫質 (搭配 --watch-add)")
+    parser.add_argument('--owner', default=DEFAULT_OWNER,
+                        help="任務擁有者 (使用者 / 團隊)，用於用量統計與配額 (搭配 --watch-add)")
+    parser.add_argument('--usage-report', metavar='PATH',
+                        help="匯出各擁有者用量報表 (.csv 或 .json) 後結束")
+    parser.add_argument('--event-port', type=int, default=EVENT_STREAM_PORT,
+                        help="在本機此埠輸出結構化事件 (NDJSON / SSE)")
+    parser.add_argument('--autotune', action='store_true', default=AUTOTUNE,
+                        help="依吞吐量、CPU 與錯誤率自動調整各階段同時數量")
+    parser.add_argument('--record', metavar='DIR',
+                        help="錄製模式：保存解析結果與下載的串流，供 --replay 使用")
+    parser.add_argument('--replay', metavar='DIR',
+                        help="重播模式：從錄製目錄讀取解析結果與串流，不連網")
+    parser.add_argument('--profile', metavar='TRACE.json',
+                        help="效能分析模式：記錄各任務階段並於結束時寫入 Chrome trace JSON")
+    parser.add_argument('--profile-sampler', choices=SAMPLERS, default="",
+                        help="同時以 cProfile 或 pyinstrument 取樣工作執行緒 (搭配 --profile)")
+    args, _ = parser.parse_known_args()
+    return args
+
+
+def run_watch(args):
+    """無介面監看模式"""
+    from downloader import check_dependencies
+    from engine.async_engine import DownloadEngine
+    from engine.autotune import AutoTuner
+    from engine.events import start_event_stream
+    from engine.subtitles import SubtitleCache
+    from engine.watcher import ChannelWatcher, WatchList
+
+    watchlist = WatchList()
+    if args.watch_add:
+        watchlist.add(args.watch_add, args.output, args.quality, args.owner)
+        print(f"已加入監看: {args.watch_add}")
+    if args.watch_remove:
+        watchlist.remove(args.watch_remove)
+        print(f"已移除監看: {args.watch_remove}")
+    if not args.watch:
+        return
+
+    check_dependencies()
+
+    def listener(kind, url, data):
+        if kind == 'status':
+            print(f"[{url}] {data.get('message', '')}")
+        elif kind == 'finished':
+            written = (data.get('bytes_written') or 0) / 1024 / 1024
+            print(f"[{url}] {'完成' if data.get('success') else '失敗'} (寫入 {written:.1f} MB)")
+
+    engine = DownloadEngine(listener=listener, subtitle_cache=SubtitleCache())
+    event_stream = start_event_stream(engine.event_bus, port=args.event_port, control=engine)
+    tuner = AutoTuner(engine)
+    if args.autotune:
+        tuner.start()
+    watcher = ChannelWatcher(engine, watchlist)
+    watcher.start()
+    print(f"監看中 ({len(watchlist.entries)} 個項目)，按 Ctrl+C 結束")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        watcher.stop()
+        tuner.stop()
+        engine.shutdown()
+        if event_stream:
+            event_stream.stop()
 
 
 def main():
     """主函數"""
+    args = parse_args()
+    if args.profile:
+        profiler.enable(args.profile, args.profile_sampler)
+    if args.replay:
+        harness.enable('replay', args.replay)
+    elif args.record:
+        harness.enable('record', args.record)
+    if args.usage_report:
+        from engine.accounting import UsageLedger
+        UsageLedger().export(args.usage_report)
+        print(f"用量報表已匯出至 {args.usage_report}")
+        return
+    if args.watch or args.watch_add or args.watch_remove:
+        run_watch(args)
+        return
+
     # 啟用高 DPI 支援
     QApplication.setHighDpiScaleFactorRoundingPolicy(
         Qt.HighDpiScaleFactorRoundingPolicy.PassThrough
     )
-    
+
     app = QApplication(sys.argv)
-    
+
     # 設定應用程式資訊
     app.setApplicationName("YouTube Downloader")
     app.setApplicationDisplayName("YouTube 影片下載器")
     app.setOrganizationName("YTDownloader")
-    
+
     # 設定預設字體
     font = QFont("Microsoft JhengHei", 10)
     app.setFont(font)
-    
+
     # 創建主視窗
-    window = MainWindow()
+    window = MainWindow(event_port=args.event_port, autotune=args.autotune)
     window.show()
-    
+
     # 執行應用程式
     sys.exit(app.exec())
 
 
 if __name__ == "__main__":
     main()
-
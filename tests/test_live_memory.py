@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+直播錄製記憶體上限測試 - 錄製長度增加十倍時，記憶體用量應維持不變
+
+以 ffmpeg 產生本機 HLS 串流並標記為直播，經由 VideoDownloader 下載，
+期間由 /proc 取樣本行程與 ffmpeg 子行程的 RSS。
+需要 yt-dlp、ffmpeg 與 /proc；缺少時略過。
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import unittest
+
+try:
+    import yt_dlp
+    from downloader import VideoDownloader, get_ffmpeg_path
+except ImportError:
+    yt_dlp = VideoDownloader = get_ffmpeg_path = None
+
+
+SHORT_DURATION = 30
+LONG_DURATION = 300
+
+# 長錄製相對短錄製可多用的記憶體
+GROWTH_LIMIT = 16 * 1024 * 1024
+# ffmpeg 封裝行程的記憶體上限
+FFMPEG_CEILING = 128 * 1024 * 1024
+
+
+def _rss(pid: int) -> int:
+    """行程目前的 RSS (bytes)，行程已結束時回傳 0"""
+    try:
+        with open(f'/proc/{pid}/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def _children(pid: int) -> list:
+    """所有子孫行程的 PID"""
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children', 'r') as f:
+            pids = [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+    for child in list(pids):
+        pids.extend(_children(child))
+    return pids
+
+
+class RssSampler:
+    """下載期間定期取樣本行程與子行程的最高 RSS"""
+
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.peak_self = 0
+        self.peak_children = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        pid = os.getpid()
+        while not self._stop.is_set():
+            self.peak_self = max(self.peak_self, _rss(pid))
+            for child in _children(pid):
+                self.peak_children = max(self.peak_children, _rss(child))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def build_stream(root: str, ffmpeg: str, duration: int) -> str:
+    """產生指定長度的 HLS 串流 (fMP4 片段)，回傳播放清單相對路徑"""
+    stream_dir = os.path.join(root, f'live{duration}')
+    os.makedirs(stream_dir)
+    subprocess.run([
+        ffmpeg, '-y', '-v', 'error',
+        '-f', 'lavfi', '-i', f'testsrc=size=160x120:rate=10:duration={duration}',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '10', '-pix_fmt', 'yuv420p', '-c:a', 'aac',
+        '-f', 'hls', '-hls_time', '1', '-hls_list_size', '0', '-hls_playlist_type', 'vod',
+        '-hls_segment_type', 'fmp4',
+        os.path.join(stream_dir, 'index.m3u8'),
+    ], check=True)
+    return f'live{duration}/index.m3u8'
+
+
+@unittest.skipIf(
+    yt_dlp is None or get_ffmpeg_path() is None or not os.path.isdir(f'/proc/{os.getpid()}/task'),
+    "需要 yt-dlp、ffmpeg 與 /proc"
+)
+class LiveMemoryTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        from engine.replay import MediaServer
+
+        cls.root = tempfile.mkdtemp(prefix='ytdl-live-')
+        ffmpeg = get_ffmpeg_path()
+        cls.playlists = {d: build_stream(cls.root, ffmpeg, d) for d in (SHORT_DURATION, LONG_DURATION)}
+        cls.server = MediaServer(cls.root)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        shutil.rmtree(cls.root, ignore_errors=True)
+
+    def setUp(self):
+        self.output = tempfile.mkdtemp(prefix='ytdl-output-')
+
+    def tearDown(self):
+        shutil.rmtree(self.output, ignore_errors=True)
+
+    def _record(self, duration: int) -> RssSampler:
+        url = self.server.base_url + self.playlists[duration]
+        info = {
+            '_type': 'video',
+            'id': f'live{duration}',
+            'title': f'Live {duration}',
+            'extractor': 'generic',
+            'extractor_key': 'Generic',
+            'webpage_url': url,
+            'is_live': True,
+            'formats': [
+                {'format_id': 'hls', 'ext': 'mp4', 'protocol': 'm3u8_native', 'url': url,
+                 'vcodec': 'avc1.42c00c', 'acodec': 'mp4a.40.2', 'width': 160, 'height': 120},
+            ],
+        }
+        downloader = VideoDownloader(url, self.output, use_aria2c=False)
+        with RssSampler() as sampler:
+            self.assertTrue(downloader.download(info))
+        files = os.listdir(self.output)
+        self.assertEqual(len(files), 1, files)
+        self.assertTrue(files[0].endswith('.mp4'))
+        os.remove(os.path.join(self.output, files[0]))
+        return sampler
+
+    def test_memory_does_not_grow_with_length(self):
+        short = self._record(SHORT_DURATION)
+        long = self._record(LONG_DURATION)
+
+        # 由 ffmpeg 邊下載邊封裝
+        self.assertGreater(long.peak_children, 0)
+        self.assertLess(long.peak_children, FFMPEG_CEILING)
+        self.assertLess(long.peak_children - short.peak_children, GROWTH_LIMIT)
+        self.assertLess(long.peak_self - short.peak_self, GROWTH_LIMIT)
+
+
+if __name__ == '__main__':
+    unittest.main()
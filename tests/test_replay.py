@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+重播測試 - 以合成的 fixture 重現完整下載流程 (不連網)
+
+需要 yt-dlp 與 ffmpeg；缺少時略過。
+"""
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+try:
+    import yt_dlp
+    from downloader import get_ffmpeg_path
+except ImportError:
+    yt_dlp = get_ffmpeg_path = None
+
+
+URL = 'https://example.com/watch?v=replay1'
+
+
+def build_fixture(root: str, ffmpeg: str) -> dict:
+    """產生 6 秒的 H.264 視訊與 AAC 音訊串流及對應的解析結果，回傳 {格式 ID: 大小}"""
+    stream_dir = os.path.join(root, 'streams', 'Generic', 'replay1')
+    os.makedirs(stream_dir)
+    streams = {
+        'v.mp4': ['-f', 'lavfi', '-i', 'testsrc=size=320x240:rate=25', '-c:v', 'libx264', '-pix_fmt', 'yuv420p'],
+        'a.m4a': ['-f', 'lavfi', '-i', 'sine=frequency=440', '-c:a', 'aac'],
+    }
+    for name, args in streams.items():
+        subprocess.run([ffmpeg, '-y', '-v', 'error', *args, '-t', '6', os.path.join(stream_dir, name)], check=True)
+    sizes = {name.split('.')[0]: os.path.getsize(os.path.join(stream_dir, name)) for name in streams}
+
+    info = {
+        '_type': 'video',
+        'id': 'replay1',
+        'title': 'Replay Test',
+        'extractor': 'generic',
+        'extractor_key': 'Generic',
+        'webpage_url': URL,
+        'duration': 6,
+        'formats': [
+            {'format_id': 'v', 'ext': 'mp4', 'vcodec': 'avc1.64001e', 'acodec': 'none', 'protocol': 'https',
+             'url': URL, 'width': 320, 'height': 240, 'filesize': sizes['v']},
+            {'format_id': 'a', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'protocol': 'https',
+             'url': URL, 'filesize': sizes['a']},
+        ],
+    }
+    name = hashlib.sha1(URL.encode('utf-8')).hexdigest()[:16]
+    with open(os.path.join(root, f"{name}.info.json"), 'w', encoding='utf-8') as f:
+        json.dump({'url': URL, 'latency': 0.01, 'info': info}, f)
+    with open(os.path.join(root, 'index.json'), 'w', encoding='utf-8') as f:
+        json.dump({URL: info['title']}, f)
+    return sizes
+
+
+@unittest.skipIf(yt_dlp is None or get_ffmpeg_path() is None, "需要 yt-dlp 與 ffmpeg")
+class ReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='ytdl-fixture-')
+        self.output = tempfile.mkdtemp(prefix='ytdl-output-')
+        self.sizes = build_fixture(self.root, get_ffmpeg_path())
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+        shutil.rmtree(self.output, ignore_errors=True)
+
+    def test_replay_downloads_and_merges(self):
+        from engine.replay import run_replay
+
+        result = run_replay(self.root, self.output, time_scale=0)
+
+        self.assertEqual(result['failed'], [])
+        self.assertEqual(result['jobs'], 1)
+        self.assertGreater(result['progress_events'], 0)
+        self.assertEqual(result['bytes_transferred'], sum(self.sizes.values()))
+
+        output = os.path.join(self.output, 'Replay Test.mp4')
+        self.assertTrue(os.path.isfile(output))
+        self.assertEqual(os.listdir(self.output), ['Replay Test.mp4'])
+        # 寫入量 = 下載的串流 + 合併封裝的輸出 (單次 ffmpeg)
+        self.assertEqual(result['bytes_written'], sum(self.sizes.values()) + os.path.getsize(output))
+
+
+if __name__ == '__main__':
+    unittest.main()
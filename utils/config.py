@@ -20,6 +20,110 @@ QUALITY_OPTIONS = {
 # 最大同時下載數
 MAX_CONCURRENT_DOWNLOADS = 6
 
+# 最大同時解析數 (僅取得影片資訊，不佔用下載名額)
+MAX_CONCURRENT_EXTRACTIONS = 16
+
+# 解析結果的有效時間 (秒)：簽章的串流網址會過期，排隊較久的任務取得下載名額後重新解析
+INFO_TTL = 30 * 60
+
+# 最大同時後處理數
+MAX_CONCURRENT_POSTPROCESS = 2
+
+# 最大同時預取縮圖數 (低優先度，不佔用下載名額)
+MAX_CONCURRENT_PREFETCH = 2
+
+# 各階段同時數量可於執行中調整的上限
+MAX_POOL_SIZE = 32
+
+# 自動調整各階段同時數量 (依吞吐量、CPU 使用率與錯誤率)
+AUTOTUNE = False
+AUTOTUNE_INTERVAL = 10          # 秒
+AUTOTUNE_MIN_GAIN = 0.05        # 增加名額後吞吐量至少需提升的比例，否則退回
+AUTOTUNE_MAX_CPU = 0.9          # CPU 使用率超過時縮減解析 / 後處理名額
+AUTOTUNE_MAX_ERROR_RATE = 0.2   # 錯誤率超過時縮減名額
+
+# 擁有者 (使用者 / 團隊) 用量統計與配額
+DEFAULT_OWNER = "default"
+USAGE_LEDGER_PATH = str(Path.home() / ".ytdownloader" / "usage.json")
+# 例如 {"team-a": {"max_concurrent": 2, "max_bytes": 500 * 1024 ** 3, "max_disk_bytes": 200 * 1024 ** 3,
+#                  "max_cpu_seconds": 3600}}，max_concurrent 為 0 或未設定時不限制
+OWNER_QUOTAS = {}
+DEFAULT_OWNER_QUOTA = {}  # 未列於 OWNER_QUOTAS 的擁有者使用的配額
+
+# 訂閱監看
+WATCHLIST_PATH = str(Path.home() / ".ytdownloader" / "watchlist.json")
+WATCH_POLL_INTERVAL = 60 * 60  # 秒
+WATCH_SEEN_IDS = 200  # 每個監看項目保留的已看過影片 ID 數
+WATCH_SEEN_STREAK = 5  # 頻道清單 (最新在前) 連續遇到幾個已看過的影片即停止翻頁
+
+# 結構化事件串流 (NDJSON / SSE，僅監聽本機；0 表示不啟用)
+EVENT_STREAM_HOST = "127.0.0.1"
+EVENT_STREAM_PORT = 0
+EVENT_QUEUE_SIZE = 256  # 每個訂閱者最多暫存的事件數，超過時丟棄進度事件 (仍不夠時丟棄最舊的事件)
+# POST /limits、/usage 需帶 "Authorization: Bearer <權杖>"；未設定時只能查詢不能修改
+EVENT_CONTROL_TOKEN = os.environ.get("YTDL_CONTROL_TOKEN", "")
+
+# 共用網路層：解析執行緒重複使用 YoutubeDL 連線池，並快取 DNS 結果
+NETWORK_POOLING = True
+DNS_CACHE_TTL = 300  # 秒
+DNS_CACHE_SIZE = 512  # 最多快取的查詢數 (超過時淘汰最久未使用的)
+
+# 共用工作階段：Cookie 與各網站的解析請求預算
+COOKIE_FILE = ""            # Netscape 格式 cookies.txt 路徑 (選用)
+COOKIES_FROM_BROWSER = ""   # 例如 "chrome"、"firefox" (選用，優先於 COOKIE_FILE)
+EXTRACT_RATE = 2.0          # 每秒解析請求數
+EXTRACT_BURST = 6           # 允許的瞬間請求數
+BREAKER_COOLDOWN = 30       # 遇到 429 / 機器人驗證時暫停的秒數 (連續發生時加倍)
+BREAKER_MAX_COOLDOWN = 15 * 60
+
+# 下載後完整性驗證
+VERIFY_DOWNLOADS = False           # 預設是否驗證 (介面可個別開啟)
+VERIFY_SIZE_TOLERANCE = 0.8        # 檔案大小至少需達預期大小的比例
+VERIFY_DURATION_TOLERANCE = 0.02   # 允許的長度誤差比例 (至少 2 秒)
+VERIFY_CHECKSUM = False            # 是否寫入 .sha256 檔案
+MAX_REDOWNLOADS = 1                # 驗證失敗時自動重新下載的次數
+
+# 字幕 / 章節 / 標籤嵌入 (於最終封裝時以單次 ffmpeg 完成)
+EMBED_SUBTITLES = False
+EMBED_METADATA = False
+SUBTITLE_LANGS = ["zh-Hant", "zh-TW", "zh", "en"]  # 依偏好順序
+SUBTITLE_AUTO = False  # 沒有人工字幕時是否使用自動字幕
+SUBTITLE_CACHE_DIR = str(Path.home() / ".ytdownloader" / "cache" / "subtitles")
+SUBTITLE_CACHE_MAX_BYTES = 20 * 1024 * 1024
+
+# CPU 轉檔 (來源非 H.264 時於最終封裝轉為 x264；None 表示不轉檔)
+TRANSCODE_PROFILES = {
+    "不轉檔": None,
+    "極速": {"preset": "ultrafast", "crf": 26},
+    "快速": {"preset": "veryfast", "crf": 23},
+    "平衡": {"preset": "medium", "crf": 21},
+}
+DEFAULT_TRANSCODE_PROFILE = "不轉檔"
+MAX_CONCURRENT_TRANSCODES = 2  # 同時轉檔數，CPU 核心平均分給每個轉檔 (-threads)
+
+# 最終封裝前以 fallocate 預先配置輸出檔案空間 (減少 NAS / 網路檔案系統上的碎片與中繼資料更新)
+PREALLOCATE_OUTPUT = True
+
+# 效能分析模式 (輸出 Chrome trace JSON；空字串表示不啟用，亦可用 --profile)
+PROFILE_TRACE_PATH = os.environ.get("YTDL_PROFILE", "")
+PROFILE_SAMPLER = os.environ.get("YTDL_PROFILE_SAMPLER", "")  # "cprofile" / "pyinstrument" (選用)
+
+# 串流去重存放區 (依影片 ID 與格式 ID 重複使用已下載的串流；需自行啟用，會佔用 STREAM_STORE_DIR 的空間)
+STREAM_STORE = False
+STREAM_STORE_DIR = str(Path.home() / ".ytdownloader" / "streams")
+STREAM_STORE_MAX_BYTES = 20 * 1024 * 1024 * 1024
+
+# 錄製 / 重播 (不連網重現下載流程，見 engine/replay.py；空字串表示不啟用)
+RECORD_DIR = os.environ.get("YTDL_RECORD_DIR", "")
+REPLAY_DIR = os.environ.get("YTDL_REPLAY_DIR", "")
+REPLAY_BANDWIDTH = 0        # 重播時每條連線的頻寬 (bytes/s)，0 表示不限速
+REPLAY_TIME_SCALE = 1.0     # 重播解析延遲的倍數，0 表示立即回應
+
+# 縮圖快取
+THUMBNAIL_CACHE_DIR = str(Path.home() / ".ytdownloader" / "cache" / "thumbnails")
+THUMBNAIL_CACHE_MAX_BYTES = 50 * 1024 * 1024
+THUMBNAIL_WIDTH = 160  # 快取前縮小至此寬度 (轉為 JPEG)
+
 # aria2c 配置
 ARIA2C_OPTIONS = [
     "--min-split-size=1M",
@@ -28,6 +132,25 @@ ARIA2C_OPTIONS = [
     "--max-concurrent-downloads=16",
 ]
 
+# 內建多連線下載器配置 (未安裝 aria2c 時使用)
+PARALLEL_DOWNLOAD_CONNECTIONS = 8
+PARALLEL_CHUNK_SIZE = 4 * 1024 * 1024
+
+# 慢速連線更換 (僅內建多連線下載器；aria2c 自行管理連線，不會更換網址)：
+# 連線速度持續低於比較基準中位數的此比例時，重新解析取得新網址。比較基準包含同一檔案的
+# 其他連線，以及行程內其他下載 (其他任務或其他主機) 最近完成各段的速度
+SLOW_CONNECTION_RATIO = 0.25
+SLOW_CONNECTION_GRACE = 5       # 每段開始後多久 (秒) 才開始比較速度
+SLOW_CONNECTION_MIN_PEERS = 2   # 至少需有幾筆其他速度可比較
+SLOW_CONNECTION_FLOOR = 0       # 檔案所有連線合計低於此速度 (bytes/s) 時一律更換網址，0 表示不使用
+MAX_URL_REFRESHES = 2           # 每個檔案最多重新取得網址的次數
+
+# 直播錄製的 ffmpeg 輸出參數 (fragmented MP4，邊下載邊寫入)
+LONG_CONTENT_FFMPEG_ARGS = [
+    "-c", "copy",
+    "-movflags", "+frag_keyframe+empty_moov+default_base_moof",
+]
+
 def get_aria2c_args():
     """獲取 aria2c 參數字串"""
     return " ".join(ARIA2C_OPTIONS)